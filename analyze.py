@@ -5,45 +5,36 @@ import mne
 from scipy.stats import ttest_ind
 import seaborn as sns
 import matplotlib.pyplot as plt
+from artifacts import summary as artifact_summary
+from bandpower import band_power_table, epoch_means
+from baseline import normalize_table
+from features import Session
+from stats import channel_adjacency, cluster_permutation_test, feature_adjacency, permutation_t_test
 
-#### Load CSV into pd df ####
+#### Load recording + stimulus log ####
 path = 'results/4/' # change to use other recordings
-data = pd.read_csv(path + 'eeg_data_cleaned.csv', 
-                   skiprows=0)
-sfreq = 250. # Sampling frequency
-
-#### Stimulus log to events processing ####
-t0_eeg = data['Timestamp'].iloc[0] # Save t0 before dropping
-data = data.drop('Timestamp', axis=1) # drop timestamp
-stim_log = pd.read_csv(path + 'stimulus_log_cleaned.csv')
-
-#### Event markers ####
-events_list = []
-for i, row in stim_log.iterrows():
-    stim_time = row['Timestamp']  # absolute time
-    onset_sec = stim_time - t0_eeg  # seconds since start of EEG
-    onset_samp = int(onset_sec * sfreq)  # convert to sample index
-
-    # Assign color code: e.g. 1 = yellow, 2 = blue
-    if row['Color'] == 'yellow':
-        color_code = 1
-    elif row['Color'] == 'blue':
-        color_code = 2
-
-    events_list.append([onset_samp, 0, color_code])
-events = np.array(events_list, dtype=int)
-
-#### EEG Channels processing ####
-ch_names = ['Fp1', 'Fp2', 'O1', 'O2', 'T5', 'T6', 'P3', 'P4'] # def channel names used in exp
-ch_types = ['eeg'] * len(ch_names) # convert all channels to eeg
-montage = mne.channels.make_standard_montage('standard_1020') # Create 10-20 international standard
-info = mne.create_info(ch_names = ch_names, sfreq = sfreq, ch_types=ch_types)
-raw = mne.io.RawArray(data.transpose(), info)
-raw.set_montage(montage)
+
+# Every stage below (filtered raw, epochs, PSD, TFR) is cached in .cache/, keyed by the
+# recording/stimulus log contents and the stage parameters, so reruns that only change
+# plotting settings load the results instead of recomputing them
+session = Session(path)
 
 #### Simple preprocessing ####
-raw.notch_filter(freqs=[60, 120]) # notch filter freq for US powerline
-raw.filter(l_freq=1., h_freq=45.) # high pass & low pass
+raw = session.filtered_raw() # 60/120 Hz notch + 1-45 Hz band-pass
+events = session.events() # onsets snapped on the drift-corrected EEG clock, see sync.py
+
+# Automatic artifact rejection (peak-to-peak, flat, variance, kurtosis, Fp1/Fp2 blinks), see
+# artifacts.py: session.epochs() below already excludes these epochs and interpolates bad channels
+artifacts = session.artifacts()
+print(artifact_summary(artifacts))
+raw.set_annotations(artifacts['annotations']) # shown as BAD_ spans in the plot
+
+# How well stimulus times line up with the EEG samples
+clock = session.clock()
+alignment = clock.alignment(pd.read_csv(path + 'stimulus_log_cleaned.csv')['Timestamp'])
+print(clock.summary())
+print(f"Event alignment error: max {alignment['error_ms'].abs().max():.2f} ms, "
+      f"naive timestamp matching off by up to {alignment['raw_offset_ms'].abs().max():.1f} ms")
 
 # Plot event markers + filtered eeg
 raw.plot(
@@ -56,16 +47,7 @@ raw.plot(
 )
 
 #### Epoching ####
-event_id = {'yellow': 1, 'blue': 2}
-epochs = mne.Epochs(
-    raw, 
-    events,
-    event_id=event_id, 
-    tmin=-0.3, 
-    tmax=4.,
-    baseline=(-0.3, 0), 
-    reject_by_annotation=True
-)
+epochs = session.epochs()
 epochs_yellow = epochs['yellow']  # all epochs with code=1
 epochs_blue   = epochs['blue']    # all epochs with code=2
 
@@ -74,37 +56,17 @@ print(epochs_blue)
 
 #### Welch ####
 
-# Welch PSD
-psd_yellow_obj = epochs_yellow.compute_psd(
-    method='welch',
-    fmin=1,
-    fmax=45,
-    n_fft=512,
-    n_overlap=256
-)
-# Access the PSD data and frequencies from the returned object
-psd_yellow = psd_yellow_obj.data
-freqs = psd_yellow_obj.freqs
-
-psd_blue_obj = epochs_blue.compute_psd(
-    method='welch',
-    fmin=1,
-    fmax=45,
-    n_fft=512,
-    n_overlap=256
-)
-psd_blue = psd_blue_obj.data
+# Welch PSD, computed once over all epochs and split by condition
+psd_obj = session.psd()
 
-# psds_yellow.shape => (n_epochs, n_channels, n_freqs)
-beta_mask = (freqs >= 13) & (freqs <= 30)
+# Power in every band (delta ... gamma, see bandpower.py) for each epoch and channel,
+# as a tidy table: epoch, condition, channel, band, power
+band_powers = band_power_table(psd_obj)
 
-# Average the beta power for each epoch and channel:
-beta_power_yellow = psd_yellow[:, :, beta_mask].mean(axis=-1)
-beta_power_blue   = psd_blue[:, :, beta_mask].mean(axis=-1)
-
-# Optionally, average across channels:
-avg_beta_yellow = beta_power_yellow.mean(axis=1)  # per-epoch average
-avg_beta_blue   = beta_power_blue.mean(axis=1)
+# Average across channels => per-epoch beta power for each condition
+avg_beta = epoch_means(band_powers, 'beta')
+avg_beta_yellow = avg_beta['yellow']
+avg_beta_blue   = avg_beta['blue']
 
 # Compare with a t-test
 t_stat, p_val = ttest_ind(avg_beta_yellow, avg_beta_blue)
@@ -128,20 +90,21 @@ legend = plt.legend()
 # Show plot
 plt.show()
 
-# For alpha waves(switch beta mask to to 8 and 12): 
-outlier_threshold = 100
-avg_beta_blue_clean = avg_beta_blue[avg_beta_blue <= outlier_threshold]
+# Alpha waves come from the same PSD, only the band mask changes
+avg_alpha = epoch_means(band_powers, 'alpha')
+avg_alpha_yellow = avg_alpha['yellow']
+avg_alpha_blue   = avg_alpha['blue']
 
-# Compare with a t-test
-t_stat, p_val = ttest_ind(avg_beta_yellow, avg_beta_blue)
+# Compare with a t-test (epochs with artifacts were rejected before the PSD, no manual threshold)
+t_stat, p_val = ttest_ind(avg_alpha_yellow, avg_alpha_blue)
 
 print(f"T-test (yellow vs. blue), t={t_stat:.3f}, p={p_val:.5f}")
 
 plt.figure(figsize=(8, 6))
 
 # Plot histograms for both groups
-sns.histplot(avg_beta_yellow, color='red', kde=True, label='Yellow', stat='density', linewidth=0)
-sns.histplot(avg_beta_blue_clean, color='blue', kde=True, label='Blue', stat='density', linewidth=0,)  # Adjusting KDE bandwidth
+sns.histplot(avg_alpha_yellow, color='red', kde=True, label='Yellow', stat='density', linewidth=0)
+sns.histplot(avg_alpha_blue, color='blue', kde=True, label='Blue', stat='density', linewidth=0,)  # Adjusting KDE bandwidth
 
 # Labels and title
 plt.xlabel('Alpha Value')
@@ -158,29 +121,51 @@ plt.legend()
 
 plt.show()
 
-#### Wavelets ####
-freqs = np.arange(2, 45, 1)
-n_cycles = freqs / 2.  # or a fixed number like 7
-
-tfr_yellow = epochs_yellow.compute_tfr(method='morlet', freqs=freqs, n_cycles=n_cycles, return_itc=False)
-tfr_blue = epochs_blue.compute_tfr(method='morlet', freqs=freqs, n_cycles=n_cycles, return_itc=False)
+#### Resting-baseline normalisation ####
+# Band power in dB of each channel's resting power from the 30 s baseline block
+# (baseline_eeg_data, computed once and cached, see baseline.py). Unlike the raw power above,
+# this doesn't depend on each electrode's contact, so no hand-set outlier threshold is needed.
+resting = session.baseline()
+band_powers['power_db'] = normalize_table(band_powers, resting, 'db')
+avg_alpha_db = epoch_means(band_powers, 'alpha', 'power_db')
+t_stat, p_val = ttest_ind(avg_alpha_db['yellow'], avg_alpha_db['blue'])
+print(f"Alpha in dB of rest (yellow vs. blue), t={t_stat:.3f}, p={p_val:.5f}")
 
-# tfr_yellow.data.shape => (n_epochs, n_channels, n_freqs, n_times)
-beta_mask = (freqs >= 13) & (freqs <= 30)
-time_mask = (tfr_yellow.times >= 0) & (tfr_yellow.times <= 4.0)
-
-# Average in freq/time
-beta_yellow = tfr_yellow.data[:, :, beta_mask, :][:, :, :, time_mask].mean(axis=(2,3))
-beta_blue   = tfr_blue.data[:, :, beta_mask, :][:, :, :, time_mask].mean(axis=(2,3))
+#### Wavelets ####
+# Morlet power (n_cycles = freqs / 2) over the beta band only, reduced to a per-epoch,
+# per-channel mean over 0-4 s while it is computed, see morlet_band_power in bandpower.py
+tfr_beta = session.tfr_bands()
 
-# Optionally average across channels => shape (n_epochs,)
-avg_beta_yellow = beta_yellow.mean(axis=1)
-avg_beta_blue   = beta_blue.mean(axis=1)
+# Average across channels => shape (n_epochs,) per condition
+avg_beta = epoch_means(tfr_beta, 'beta')
+avg_beta_yellow = avg_beta['yellow']
+avg_beta_blue   = avg_beta['blue']
 
 # Stats
 t_stat, p_val = ttest_ind(avg_beta_yellow, avg_beta_blue)
 print(f"TFR-based beta comparison: t={t_stat:.3f}, p={p_val:.5f}")
 
+#### Permutation statistics ####
+# Every channel x frequency bin of the Welch PSD instead of one channel-averaged value per
+# epoch: max-t permutation test (family-wise error over all bins) and a cluster test with
+# scalp neighbours and adjacent frequency bins, see stats.py. The same functions take
+# (epochs, channel, freq, time) arrays, e.g. session.tfr()['yellow'].data.
+psd_yellow = psd_obj['yellow'].get_data()
+psd_blue = psd_obj['blue'].get_data()
+freqs = psd_obj.freqs
+
+t_obs, p_corrected, p_uncorrected = permutation_t_test(psd_yellow, psd_blue, n_permutations=10000)
+for ch, f in np.argwhere(p_corrected < 0.05):
+    print(f"max-t: {epochs.ch_names[ch]} {freqs[f]:.1f} Hz, t={t_obs[ch, f]:.2f}, p={p_corrected[ch, f]:.4f}")
+print(f"{(p_corrected < 0.05).sum()} of {p_corrected.size} channel x frequency bins significant after max-t correction")
+
+adjacency = feature_adjacency(psd_yellow.shape[1:], channel_adjacency(epochs.info))
+t_obs, clusters, cluster_p, masses = cluster_permutation_test(psd_yellow, psd_blue, adjacency, n_permutations=10000)
+for cluster, p, mass in zip(clusters, cluster_p, masses):
+    channels, bins = np.nonzero(cluster)
+    print(f"cluster: {sorted({epochs.ch_names[c] for c in channels})}, {freqs[bins].min():.1f}-{freqs[bins].max():.1f} Hz, "
+          f"sum t={mass:.1f}, p={p:.4f}")
+
 #### VISUALS ####
 
 ## Evoked ##
@@ -0,0 +1,176 @@
+# Imports
+import argparse
+import os
+
+import mne
+import numpy as np
+from scipy.stats import kurtosistest
+
+# Automatic artifact rejection on the whole (epochs, channels, times) array at once, in place
+# of a hand-set outlier threshold on channel averages:
+#   python artifacts.py results/4          # summary + results/4/artifact_annotations.csv
+#
+# Every check gives an (epoch, channel) flag matrix:
+#   ptp       peak-to-peak above PTP_LIMIT_UV
+#   flat      peak-to-peak below FLAT_UV
+#   variance  log variance, robust z across the channel's epochs above Z_LIMIT
+#   kurtosis  kurtosis as a normal deviate (Anscombe-Glynn, scipy's kurtosistest), same robust
+#             z (spikes, electrode pops); the sample kurtosis itself is right-skewed, and its
+#             robust z flagged 2-10% of the epochs of pure Gaussian noise
+# and blinks are found on the Fp1/Fp2 average. A channel flagged in more than
+# BAD_CHANNEL_FRACTION of the blink-free epochs is bad and interpolated; an epoch is dropped
+# when one of its good channels is flagged or it holds a blink. When half or more of the
+# channels are bad there is too little left to interpolate from, and the bad channels are
+# dropped instead, so every later stage sees the same, smaller channel set. Values are in uV,
+# the unit the recordings hold (MNE calls it V).
+
+PTP_LIMIT_UV = 200.
+FLAT_UV = 1.
+Z_LIMIT = 4.  # robust z, median / scaled MAD; both checked values are about normal for clean data
+BLINK_UV = 100.
+BLINK_CHANNELS = ['Fp1', 'Fp2']
+BLINK_PAD = 0.2  # seconds annotated around each blink
+BAD_CHANNEL_FRACTION = 0.5
+CHECKS = ['ptp', 'flat', 'variance', 'kurtosis']
+ANNOTATIONS_FILE = 'artifact_annotations.csv'
+
+
+def robust_z(x, axis=0):
+    """(x - median) / (1.4826 MAD) along axis, 0 where the MAD is 0."""
+    median = np.median(x, axis=axis, keepdims=True)
+    mad = 1.4826 * np.median(np.abs(x - median), axis=axis, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = (x - median) / mad
+    return np.nan_to_num(z, nan=0., posinf=0., neginf=0.)
+
+
+def channel_flags(data, ptp_limit=PTP_LIMIT_UV, flat=FLAT_UV, z_limit=Z_LIMIT):
+    """{check: (n_epochs, n_channels) bool} for a (n_epochs, n_channels, n_times) array."""
+    ptp = np.ptp(data, axis=-1)
+    log_var = np.log(np.maximum(data.var(axis=-1), np.finfo(float).tiny))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kurtosis_z = np.nan_to_num(kurtosistest(data, axis=-1).statistic)  # flat: NaN -> 0
+    return {
+        'ptp': ptp > ptp_limit,
+        'flat': ptp < flat,
+        'variance': robust_z(log_var) > z_limit,
+        'kurtosis': robust_z(kurtosis_z) > z_limit,
+    }
+
+
+def blink_mask(data, ch_names, threshold=BLINK_UV):
+    """(n_epochs, n_times) bool, samples where the Fp1/Fp2 average leaves its epoch median by threshold.
+
+    None when the montage has no frontopolar channel.
+    """
+    picks = [ch_names.index(ch) for ch in BLINK_CHANNELS if ch in ch_names]
+    if not picks:
+        return None
+    frontal = data[:, picks].mean(axis=1)
+    return np.abs(frontal - np.median(frontal, axis=-1, keepdims=True)) > threshold
+
+
+def _runs(mask):
+    """(row, start, stop) of every run of True along the last axis of a 2-D mask."""
+    padded = np.pad(mask, ((0, 0), (1, 1))).astype(np.int8)
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, stops = np.nonzero(edges == -1)  # same row-major order as the starts
+    return rows, starts, stops
+
+
+def detect_artifacts(epochs, ptp_limit=PTP_LIMIT_UV, flat=FLAT_UV, z_limit=Z_LIMIT, blink=BLINK_UV,
+                     bad_fraction=BAD_CHANNEL_FRACTION):
+    """Bad channels, dropped epochs and annotations of an Epochs object (not modified).
+
+    Returns a dict: ch_names (the channels checked), bad_channels, drop (epoch indices), reasons
+    (one per dropped epoch), flags ({check: (epoch, channel) bool}), blinks (epoch bool) and
+    annotations, onsets in seconds of the recording the epochs were cut from.
+    """
+    data = epochs.get_data()
+    ch_names = list(epochs.ch_names)
+    flags = channel_flags(data, ptp_limit, flat, z_limit)
+    mask = blink_mask(data, ch_names, blink)
+    blinks = mask.any(axis=1) if mask is not None else np.zeros(len(data), dtype=bool)
+
+    any_flag = np.any(list(flags.values()), axis=0)  # (epoch, channel)
+    clean = ~blinks if (~blinks).any() else np.ones_like(blinks)
+    bad = any_flag[clean].mean(axis=0) > bad_fraction
+    bad_channels = [ch for ch, is_bad in zip(ch_names, bad) if is_bad]
+
+    # First reason per epoch: blink, then the checks in CHECKS order, on good channels only
+    reasons = np.full(len(data), '', dtype=object)
+    for check in reversed(CHECKS):
+        reasons[flags[check][:, ~bad].any(axis=1)] = check
+    reasons[blinks] = 'blink'
+    drop = np.flatnonzero(reasons != '')
+
+    # Annotations on the continuous recording: the whole epoch for channel checks, the
+    # blink itself (padded) for blinks, so raw.plot shows them and re-epoching rejects them
+    sfreq = epochs.info['sfreq']
+    epoch_start = epochs.events[:, 0] / sfreq + epochs.tmin
+    onsets, durations, descriptions = [], [], []
+    channel_drop = drop[reasons[drop] != 'blink']
+    onsets.append(epoch_start[channel_drop])
+    durations.append(np.full(len(channel_drop), epochs.times[-1] - epochs.times[0]))
+    descriptions.append(np.array(['BAD_' + reason for reason in reasons[channel_drop]], dtype=object))
+    if mask is not None:
+        rows, starts, stops = _runs(mask)
+        onsets.append(epoch_start[rows] + starts / sfreq - BLINK_PAD)
+        durations.append((stops - starts) / sfreq + 2 * BLINK_PAD)
+        descriptions.append(np.full(len(rows), 'BAD_blink', dtype=object))
+    annotations = mne.Annotations(np.concatenate(onsets), np.concatenate(durations),
+                                  np.concatenate(descriptions).astype(str))
+
+    return {
+        'ch_names': ch_names,
+        'bad_channels': bad_channels,
+        'drop': drop,
+        'reasons': reasons[drop].astype(str),
+        'flags': flags,
+        'blinks': blinks,
+        'annotations': annotations,
+        'n_epochs': len(data),
+        'params': {'ptp_limit': ptp_limit, 'flat': flat, 'z_limit': z_limit, 'blink': blink,
+                   'bad_fraction': bad_fraction},
+    }
+
+
+def apply_artifacts(epochs, artifacts):
+    """Copy of epochs without the dropped epochs, bad channels interpolated from their neighbours.
+
+    With half or more of the channels bad, the bad channels are dropped instead of interpolated.
+    """
+    epochs = epochs.copy()
+    epochs.drop(artifacts['drop'], reason=list(artifacts['reasons']))
+    bad_channels = artifacts['bad_channels']
+    if bad_channels and len(bad_channels) < len(epochs.ch_names) / 2:
+        epochs.info['bads'] = list(bad_channels)
+        epochs.interpolate_bads(reset_bads=True)
+    elif bad_channels:
+        # Too few good channels to interpolate from. Only marking them bad would leave them in
+        # get_data() but not in compute_psd(), so they go.
+        epochs.drop_channels(bad_channels)
+    return epochs
+
+
+def summary(artifacts):
+    reasons, counts = np.unique(artifacts['reasons'], return_counts=True)
+    by_reason = ', '.join(f'{reason} {count}' for reason, count in zip(reasons, counts)) or 'none'
+    return (f"{len(artifacts['drop'])} of {artifacts['n_epochs']} epochs dropped ({by_reason}), "
+            f"bad channels: {', '.join(artifacts['bad_channels']) or 'none'}")
+
+
+if __name__ == '__main__':
+    from features import Session
+
+    parser = argparse.ArgumentParser(description='Detects artifacts in a participant folder')
+    parser.add_argument('folder', help='results/<participant_id>')
+    args = parser.parse_args()
+
+    mne.set_log_level('WARNING')
+    artifacts = Session(args.folder).artifacts()
+    print(summary(artifacts))
+    annotations_file = os.path.join(args.folder, ANNOTATIONS_FILE)
+    artifacts['annotations'].save(annotations_file, overwrite=True)
+    print(f'Annotations saved to: {annotations_file}')
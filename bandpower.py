@@ -0,0 +1,103 @@
+# Imports
+import numpy as np
+import pandas as pd
+
+# Frequency bands in Hz, edges inclusive like the original beta mask (13 <= f <= 30)
+BANDS = {
+    'delta': (1, 4),
+    'theta': (4, 8),
+    'alpha': (8, 12),
+    'beta': (13, 30),
+    'gamma': (30, 45),
+}
+
+
+def band_weights(freqs, bands=BANDS):
+    """(n_bands, n_freqs) matrix whose rows average the frequencies inside each band."""
+    freqs = np.asarray(freqs)
+    edges = np.array(list(bands.values()), dtype=float)
+    masks = (freqs[None, :] >= edges[:, :1]) & (freqs[None, :] <= edges[:, 1:])
+    counts = masks.sum(axis=1, keepdims=True)
+    if (counts == 0).any():
+        empty = [name for name, count in zip(bands, counts[:, 0]) if count == 0]
+        raise ValueError(f"No frequency bins inside band(s) {empty}, PSD covers {freqs[0]}-{freqs[-1]} Hz")
+    return masks / counts
+
+
+def band_power(data, freqs, bands=BANDS):
+    """Mean power per band for a (..., n_freqs) array, returns (..., n_bands) in one matmul.
+
+    Adding a band adds a row to the weight matrix, the PSD itself is never recomputed.
+    """
+    return data @ band_weights(freqs, bands).T
+
+
+def tidy_table(power, conditions, ch_names, bands):
+    """Flattens a (n_epochs, n_channels, n_bands) array into epoch/condition/channel/band/power rows."""
+    n_epochs, n_channels, n_bands = power.shape
+    return pd.DataFrame({
+        'epoch': np.repeat(np.arange(n_epochs), n_channels * n_bands),
+        'condition': np.repeat(np.asarray(conditions), n_channels * n_bands),
+        'channel': np.tile(np.repeat(np.asarray(ch_names), n_bands), n_epochs),
+        'band': np.tile(np.asarray(list(bands)), n_epochs * n_channels),
+        'power': power.ravel(),
+    })
+
+
+def band_power_table(spectrum, bands=BANDS):
+    """Tidy band power table of an EpochsSpectrum holding all conditions."""
+    codes = {code: name for name, code in spectrum.event_id.items()}
+    conditions = [codes[code] for code in spectrum.events[:, 2]]
+    power = band_power(spectrum.get_data(), spectrum.freqs, bands)
+    return tidy_table(power, conditions, spectrum.ch_names, bands)
+
+
+def epoch_means(table, band, column='power'):
+    """Channel-averaged power of one band, per epoch, as {condition: array}."""
+    means = table[table['band'] == band].groupby(['condition', 'epoch'], sort=False)[column].mean()
+    return {condition: means[condition].to_numpy() for condition in means.index.unique('condition')}
+
+
+def band_freqs(bands=BANDS, freq_step=1.):
+    """Frequencies the Morlet stage needs: a freq_step grid over the union of the bands."""
+    grids = [np.arange(lo, hi + freq_step / 2, freq_step) for lo, hi in bands.values()]
+    return np.unique(np.concatenate(grids))
+
+
+def morlet_band_power(epochs, bands=BANDS, tmin=0., tmax=4., decim=5, freq_step=1.,
+                      n_cycles_per_hz=0.5, keep_time=False, epoch_chunk=4):
+    """Morlet power reduced to bands while it is computed, epoch chunk by epoch chunk.
+
+    Only the frequencies inside the bands are convolved and only the tmin-tmax window is
+    kept. Each chunk of epochs is reduced to (n_epochs, n_channels, n_bands) before the next
+    one is computed, so the full (n_epochs, n_channels, n_freqs, n_times) power array never
+    exists. With keep_time the band power time courses are kept instead, decimated by
+    averaging blocks of decim samples, shape (n_epochs, n_channels, n_bands, n_times).
+    On the same frequencies the band means match averaging the output of
+    epochs.compute_tfr(method='morlet', n_cycles=freqs * n_cycles_per_hz).
+
+    Returns (power, times), times being the centre of each kept (decimated) sample.
+    """
+    import mne  # only this stage needs it, the online monitor imports band_power without mne
+
+    freqs = band_freqs(bands, freq_step)
+    weights = band_weights(freqs, bands)
+    n_cycles = freqs * n_cycles_per_hz
+    window = np.flatnonzero((epochs.times >= tmin) & (epochs.times <= tmax))
+    window = slice(window[0], window[-1] + 1)
+    # Block averaging instead of plain slicing, so decimating doesn't alias the power ripple
+    blocks = np.arange(0, window.stop - window.start, decim)
+    counts = np.diff(np.append(blocks, window.stop - window.start))
+    times = np.add.reduceat(epochs.times[window], blocks) / counts
+
+    chunks = []
+    for start in range(0, len(epochs), epoch_chunk):
+        data = epochs.get_data(item=slice(start, start + epoch_chunk))
+        power = mne.time_frequency.tfr_array_morlet(
+            data, epochs.info['sfreq'], freqs, n_cycles=n_cycles, decim=window, output='power')
+        if keep_time:
+            power = np.add.reduceat(power, blocks, axis=-1) / counts
+            chunks.append(np.einsum('ecft,bf->ecbt', power, weights))
+        else:
+            chunks.append(power.mean(axis=-1) @ weights.T)
+    return np.concatenate(chunks), times
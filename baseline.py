@@ -0,0 +1,74 @@
+# Imports
+import mne
+import numpy as np
+import pandas as pd
+
+from bandpower import BANDS, band_power
+
+# Per-channel normalisation against the resting baseline block every session records
+# (baseline_eeg_data, bracketed by markers 999/1000) instead of the 300 ms before each word.
+#
+# The filtered baseline is cut into overlapping SEGMENT-long pieces, each gets the Welch PSD
+# the epochs get, and the band power of the pieces gives a resting mean and SD per channel
+# and band. Session.baseline() caches these (they are a few hundred numbers), and normalize()
+# applies them to any (..., channel, band) power array with broadcasting:
+#   db:     10 log10(power / resting mean)
+#   zscore: (power - resting mean) / resting SD
+# Both remove each channel's own scale (electrode contact, amplifier offsets), so features
+# compare across channels and participants.
+
+BASELINE_NAME = 'baseline_eeg_data'
+SEGMENT = 4.  # seconds, about one epoch; must cover the Welch n_fft
+SEGMENT_OVERLAP = 2.
+NORMALIZATIONS = ('db', 'zscore')
+
+
+def resting_stats(raw, welch_params, bands=BANDS, segment=SEGMENT, overlap=SEGMENT_OVERLAP):
+    """Resting PSD and band power statistics of a filtered baseline recording.
+
+    Returns a dict: ch_names, bands, freqs, psd (channel, freq) averaged over segments, and
+    mean / std (channel, band) of the segments' band power.
+    """
+    segments = mne.make_fixed_length_epochs(raw, duration=segment, overlap=overlap, preload=True)
+    if len(segments) < 2:
+        raise ValueError(f'Baseline too short: {raw.times[-1]:.1f} s gives {len(segments)} segment(s) of {segment} s')
+    spectrum = segments.compute_psd(**welch_params)
+    psd = spectrum.get_data()
+    power = band_power(psd, spectrum.freqs, bands)
+    return {
+        'ch_names': list(spectrum.ch_names),
+        'bands': list(bands),
+        'freqs': spectrum.freqs,
+        'psd': psd.mean(axis=0),
+        'mean': power.mean(axis=0),
+        'std': power.std(axis=0, ddof=1),
+        'n_segments': len(segments),
+    }
+
+
+def pick_channels(stats, ch_names):
+    """Resting statistics of ch_names only, in that order (e.g. epochs whose bad channels were dropped)."""
+    rows = [stats['ch_names'].index(ch) for ch in ch_names]
+    return dict(stats, ch_names=list(ch_names), psd=stats['psd'][rows], mean=stats['mean'][rows],
+                std=stats['std'][rows])
+
+
+def normalize(power, stats, method='db'):
+    """Normalises a (..., channel, band) power array with resting statistics, in one broadcast."""
+    if method == 'db':
+        return 10 * np.log10(power / stats['mean'])
+    if method == 'zscore':
+        return (power - stats['mean']) / stats['std']
+    raise ValueError(f'Unknown normalisation {method!r}, use one of {NORMALIZATIONS}')
+
+
+def normalize_table(table, stats, method='db'):
+    """Normalised 'power' column of a tidy band power table, NaN for channels/bands without statistics."""
+    ch = pd.Index(stats['ch_names']).get_indexer(table['channel'])
+    band = pd.Index(stats['bands']).get_indexer(table['band'])
+    known = (ch >= 0) & (band >= 0)
+    values = np.full(len(table), np.nan)
+    # Pick each row's statistics with fancy indexing, then normalise every row at once
+    row_stats = {name: stats[name][ch[known], band[known]] for name in ('mean', 'std')}
+    values[known] = normalize(table['power'].to_numpy()[known], row_stats, method)
+    return values
@@ -0,0 +1,106 @@
+# Imports
+import argparse
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import clean_data
+import stim_cleanup
+from features import extract_features
+from loader import find_recording
+
+# Runs cleaning, stimulus-log mapping and feature extraction for every results/<id>/ folder,
+# one participant per worker process:
+#   python batch.py                      # all participants, one worker per core
+#   python batch.py --workers 4 --steps clean stim
+
+
+def discover_participants(root_folder='results'):
+    """Every subfolder of root_folder, numeric ids in numeric order."""
+    folders = [name for name in os.listdir(root_folder)
+               if os.path.isdir(os.path.join(root_folder, name))]
+    return sorted(folders, key=lambda name: (not name.isdigit(), int(name) if name.isdigit() else 0, name))
+
+
+def _clean(folder):
+    outputs = []
+    for filename in clean_data.files_to_clean:
+        file_path = os.path.join(folder, filename)
+        if os.path.exists(file_path):
+            outputs.append(clean_data.clean_file(file_path))
+    return outputs
+
+
+def _stim(folder):
+    return stim_cleanup.clean_stim_log(os.path.join(folder, stim_cleanup.filename))
+
+
+def _features(folder):
+    if not os.path.exists(find_recording(folder)):
+        return None  # baseline-only session, nothing to extract
+    return extract_features(folder)
+
+
+STEPS = {
+    'clean': _clean,
+    'stim': _stim,
+    'features': _features,
+}
+
+
+def process_participant(folder, steps=tuple(STEPS)):
+    """Runs the steps for one participant; a failing step is recorded and stops only this participant."""
+    report = {'folder': folder, 'ok': True, 'steps': {}}
+    start = time.perf_counter()
+    for step in steps:
+        step_start = time.perf_counter()
+        try:
+            result = STEPS[step](folder)
+            report['steps'][step] = {'ok': True, 'result': result}
+        except Exception:
+            report['steps'][step] = {'ok': False, 'error': traceback.format_exc()}
+            report['ok'] = False
+            break  # later steps depend on the earlier ones
+        finally:
+            report['steps'][step]['seconds'] = time.perf_counter() - step_start
+    report['seconds'] = time.perf_counter() - start
+    return report
+
+
+def run_batch(root_folder='results', participants=None, steps=tuple(STEPS), max_workers=None):
+    """Processes participants in a process pool, printing progress as they finish."""
+    if participants is None:
+        participants = discover_participants(root_folder)
+    folders = [os.path.join(root_folder, str(p)) for p in participants]
+    reports = []
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(process_participant, folder, tuple(steps)): folder for folder in folders}
+        for n_done, future in enumerate(as_completed(futures), start=1):
+            folder = futures[future]
+            try:
+                report = future.result()
+            except Exception:  # the worker process itself died
+                report = {'folder': folder, 'ok': False, 'steps': {}, 'seconds': 0.,
+                          'error': traceback.format_exc()}
+            reports.append(report)
+            failed = [s for s, r in report['steps'].items() if not r['ok']]
+            status = 'ok' if report['ok'] else f"FAILED in {failed[0] if failed else 'worker'}"
+            print(f"[{n_done}/{len(folders)}] {folder}: {status} ({report['seconds']:.1f} s)")
+    return reports
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batch preprocessing over results/<participant_id>/')
+    parser.add_argument('participants', nargs='*', help='participant ids (default: every folder in root)')
+    parser.add_argument('--root', default='results')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--steps', nargs='+', choices=list(STEPS), default=list(STEPS))
+    args = parser.parse_args()
+
+    reports = run_batch(args.root, args.participants or None, args.steps, args.workers)
+    failed = [r for r in reports if not r['ok']]
+    for report in failed:
+        errors = [r['error'] for r in report['steps'].values() if not r['ok']] or [report.get('error', '')]
+        print(f"\n{report['folder']}:\n{errors[0]}")
+    print(f'{len(reports) - len(failed)}/{len(reports)} participants processed')
@@ -0,0 +1,245 @@
+# Imports
+import argparse
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+from brainflow.board_shim import BoardIds, BoardShim, BrainFlowInputParams
+
+from clean_data import clean_file
+from recorder import StreamRecorder
+
+# Headless benchmark of the acquisition + save path: no participant, no PsychoPy.
+#
+#   python bench_acquisition.py                        # 30 s to 2 h sessions at 60x real time
+#   python bench_acquisition.py --realtime --durations 30 60
+#   python bench_acquisition.py --json bench.json      # machine-readable, to compare commits
+#
+# Each session runs the StreamRecorder that the experiment uses, next to a null window that
+# stands in for PsychoPy's frame loop. The board is either BrainFlow's synthetic board in real
+# time or AcceleratedBoard, which serves synthetic samples `speed` times faster than the
+# sampling rate (the null window keeps flipping at the real frame rate either way). Every
+# (backend, duration) pair runs in a fresh process so peak RSS is its own.
+
+DURATIONS = [30, 300, 1800, 7200]  # seconds of simulated session
+SPEED = 60.  # accelerated sessions run this many times faster than real time
+FRAME_RATE = 60.
+BACKENDS = {
+    # name: (file extension, StreamRecorder dtype, compression)
+    'eegrec': ('.eegrec', 'float64', None),
+    'eegrec-float32': ('.eegrec', 'float32', None),
+    'eegrec-zlib': ('.eegrec', 'float64', 'zlib'),
+    'csv': ('.csv', 'float64', None),
+}
+PACKAGE_MODULO = 256
+
+
+class AcceleratedBoard:
+    """Stands in for a streaming BoardShim, producing synthetic samples at speed x real time.
+
+    Only the calls StreamRecorder makes are implemented. Samples look like the board's own:
+    same rows, a wrapping package counter and host timestamps on the simulated clock.
+    """
+
+    def __init__(self, board_id, speed=SPEED, seed=0):
+        board = BoardShim.get_board_descr(board_id)
+        self.board_id = board_id
+        self.speed = speed
+        self.sfreq = board['sampling_rate']
+        self.n_rows = board['num_rows']
+        self.eeg_rows = board['eeg_channels']
+        self.package_row = board['package_num_channel']
+        self.timestamp_row = board['timestamp_channel']
+        # 10 s of noise, tiled, so producing samples costs no more than a real board's copy
+        self._noise = np.random.default_rng(seed).normal(0., 20., (len(self.eeg_rows), int(10 * self.sfreq)))
+        self._produced = 0  # samples produced by earlier start/stop_stream periods
+        self._consumed = 0
+        self._started = None
+
+    def start_stream(self):
+        self._started = time.monotonic()
+        self._start_time = time.time()
+
+    def stop_stream(self):
+        self._produced = self._available()
+        self._started = None
+
+    def release_session(self):
+        pass
+
+    def _available(self):
+        if self._started is None:
+            return self._produced
+        return self._produced + int((time.monotonic() - self._started) * self.sfreq * self.speed)
+
+    def get_board_data_count(self):
+        return self._available() - self._consumed
+
+    def get_board_data(self, num_samples=None):
+        count = self.get_board_data_count()
+        if num_samples is not None:
+            count = min(count, num_samples)
+        index = np.arange(self._consumed, self._consumed + count)
+        data = np.zeros((self.n_rows, count))
+        data[self.eeg_rows] = self._noise[:, index % self._noise.shape[1]]
+        data[self.package_row] = index % PACKAGE_MODULO
+        data[self.timestamp_row] = self._start_time + index / self.sfreq
+        self._consumed += count
+        return data
+
+
+class NullWindow:
+    """PsychoPy's frame loop without a screen: flip() waits for the next frame.
+
+    Counts frames that came later than 1.5 frame periods, the threshold PsychoPy uses for
+    dropped frames, so a recorder that starves the main thread shows up.
+    """
+
+    def __init__(self, frame_rate=FRAME_RATE):
+        self.frame_duration = 1. / frame_rate
+        self.n_frames = 0
+        self.n_dropped = 0
+        self._next = None
+
+    def flip(self):
+        now = time.perf_counter()
+        if self._next is None:
+            self._next = now
+        elif now - self._next > 0.5 * self.frame_duration:
+            self.n_dropped += 1
+            self._next = now  # a dropped frame doesn't shift the ones after it
+        self._next += self.frame_duration
+        time.sleep(max(0., self._next - time.perf_counter()))
+        self.n_frames += 1
+        return self._next
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.  # KB on Linux
+
+
+def _file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def run_session(backend, duration, board_id=BoardIds.SYNTHETIC_BOARD.value, speed=SPEED,
+                realtime=False, directory=None):
+    """Records one simulated session with one storage backend, returns its measurements."""
+    extension, dtype, compression = BACKENDS[backend]
+    directory = directory or tempfile.mkdtemp(prefix='bench_acquisition_')
+    path = os.path.join(directory, f'eeg_data_{backend}_{duration}s{extension}')
+    rss_before = _peak_rss_mb()
+
+    if realtime:
+        speed = 1.
+        BoardShim.disable_board_logger()
+        board = BoardShim(board_id, BrainFlowInputParams())
+        board.prepare_session()
+    else:
+        board = AcceleratedBoard(board_id, speed)
+    window = NullWindow()  # always real frame rate, it only runs for duration / speed seconds
+
+    recorder = StreamRecorder(board, board_id, path, dtype=dtype, compression=compression)
+    start = time.perf_counter()
+    board.start_stream()
+    recorder.start()
+    for _ in range(int(duration / speed * FRAME_RATE)):
+        window.flip()
+    acquisition_seconds = time.perf_counter() - start
+
+    # End of session: what the participant waits through before the memory test
+    stall_start = time.perf_counter()
+    board.stop_stream()
+    n_samples = recorder.stop()
+    board.release_session()
+    stall_seconds = time.perf_counter() - stall_start
+
+    clean_seconds = None
+    cleaned_size = None
+    if extension == '.csv':
+        clean_start = time.perf_counter()
+        cleaned = clean_file(path, board_id=board_id, force=True)
+        clean_seconds = time.perf_counter() - clean_start
+        cleaned_size = _file_size(cleaned)
+
+    file_size = _file_size(path)
+    total_seconds = time.perf_counter() - start
+    return {
+        'backend': backend,
+        'duration': duration,
+        'speed': speed,
+        'n_samples': n_samples,
+        # What the recorder sustains: samples over the time spent appending, flushing and closing.
+        # n_samples / acquisition_seconds would only be the board's production rate.
+        'samples_per_second': n_samples / recorder.write_seconds,
+        'write_seconds': recorder.write_seconds,
+        'board_samples_per_second': n_samples / acquisition_seconds,
+        'write_mb_per_second': file_size / 2 ** 20 / (acquisition_seconds + stall_seconds),
+        'acquisition_seconds': acquisition_seconds,
+        'stall_seconds': stall_seconds,
+        'clean_seconds': clean_seconds,
+        'total_seconds': total_seconds,
+        'file_mb': file_size / 2 ** 20,
+        'cleaned_mb': None if cleaned_size is None else cleaned_size / 2 ** 20,
+        'peak_rss_mb': _peak_rss_mb(),
+        'rss_growth_mb': _peak_rss_mb() - rss_before,
+        'frames': window.n_frames,
+        'dropped_frames': window.n_dropped,
+    }
+
+
+def run_benchmark(backends=tuple(BACKENDS), durations=DURATIONS, board_id=BoardIds.SYNTHETIC_BOARD.value,
+                  speed=SPEED, realtime=False, keep=False):
+    """Runs every (backend, duration) session in its own process, returns the list of results."""
+    directory = tempfile.mkdtemp(prefix='bench_acquisition_')
+    results = []
+    try:
+        # A fresh process per session, so peak RSS and the page cache state are per session
+        # (one single-worker pool each: max_tasks_per_child needs Python 3.11)
+        context = get_context('spawn')
+        for duration in durations:
+            for backend in backends:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    result = pool.submit(run_session, backend, duration, board_id, speed, realtime,
+                                         directory).result()
+                results.append(result)
+                print(format_result(result))
+    finally:
+        if keep:
+            print(f'Recordings kept in {directory}')
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def format_result(r):
+    clean = '' if r['clean_seconds'] is None else f", clean {r['clean_seconds']:.2f} s"
+    return (f"{r['backend']:>15} {r['duration']:>6} s: {r['samples_per_second']:>9.0f} samples/s written, "
+            f"stall {r['stall_seconds']:.3f} s{clean}, {r['file_mb']:.1f} MB, "
+            f"peak RSS {r['peak_rss_mb']:.0f} MB, {r['dropped_frames']}/{r['frames']} frames dropped")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless benchmark of EEG acquisition and saving')
+    parser.add_argument('--durations', nargs='+', type=float, default=DURATIONS, help='session lengths in seconds')
+    parser.add_argument('--backends', nargs='+', choices=list(BACKENDS), default=list(BACKENDS))
+    parser.add_argument('--board-id', type=int, default=BoardIds.SYNTHETIC_BOARD.value,
+                        help='board whose layout is simulated (default: synthetic)')
+    parser.add_argument('--speed', type=float, default=SPEED, help='simulated seconds per real second')
+    parser.add_argument('--realtime', action='store_true', help="use BrainFlow's synthetic board in real time")
+    parser.add_argument('--keep', action='store_true', help='keep the recordings')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    BoardShim.disable_board_logger()
+    results = run_benchmark(args.backends, args.durations, args.board_id, args.speed, args.realtime, args.keep)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}, file, indent=2)
+        print(f'Results saved to: {args.json}')
@@ -0,0 +1,299 @@
+# Imports
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import time
+import tracemalloc
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import matplotlib
+matplotlib.use('Agg')  # never open a window, the benchmark runs unattended
+import matplotlib.pyplot as plt
+import mne
+import numpy as np
+import pandas as pd
+from brainflow.board_shim import BoardShim
+from scipy.stats import ttest_1samp, ttest_ind
+
+from artifacts import apply_artifacts, detect_artifacts
+from bandpower import band_power_table, epoch_means, morlet_band_power
+from batch import discover_participants
+from events import COLOR_CODES, build_events, session_color_codes
+from features import (ARTIFACT_PARAMS, STIM_LOG_FILE, TFR_BANDS, TFR_TMAX, TFR_TMIN, WELCH_PARAMS,
+                      make_epochs, preprocess)
+from loader import CH_NAMES, find_recording, load_package_num, load_raw
+from recording import EXTENSION, RecordingWriter
+from stats import N_PERMUTATIONS, channel_adjacency, cluster_permutation_test, feature_adjacency, permutation_t_test
+from sync import ClockSync
+
+# Benchmark of the analysis stages, the ones analyze.py runs, without plots or the stage cache.
+#
+#   python bench_analysis.py --json bench_analysis.json           # results/ + synthetic grid
+#   python bench_analysis.py --hours 0.25 --channels 8 --no-results
+#   python bench_analysis.py --json new.json --compare old.json   # per-stage ratios
+#
+# Every dataset runs in a fresh process. Each stage reports wall time and the peak of the
+# memory it allocated (tracemalloc, numpy arrays included) plus the process's peak RSS so far.
+# A stage that fails is reported with its error and the stages that need it are skipped.
+
+STAGES = ['load', 'events', 'filter', 'epoch', 'artifacts', 'welch', 'tfr', 'stats', 'topomap']
+RESULTS_ROOT = 'results'
+SYNTHETIC_DIR = os.path.join('.cache', 'bench')
+HOURS = [0.25, 1., 2.]
+CHANNELS = [8, 16, 32]
+# 250 Hz boards with 8, 16 and 32 EEG channels, whose layout the synthetic recordings take
+SYNTHETIC_BOARDS = {8: 0, 16: -1, 32: 55}  # Cyton, BrainFlow synthetic, Explore+ 32
+TRIAL_PERIOD = 5.5  # seconds from one word onset to the next (4 + 0.5 + 1), like the experiment
+STANDARD_NAMES = ['Fp1', 'Fp2', 'F7', 'F3', 'Fz', 'F4', 'F8', 'T7', 'C3', 'Cz', 'C4', 'T8', 'P7', 'P3',
+                  'Pz', 'P4', 'P8', 'O1', 'O2', 'AF3', 'AF4', 'FC5', 'FC1', 'FC2', 'FC6', 'CP5', 'CP1',
+                  'CP2', 'CP6', 'PO3', 'PO4', 'Oz']
+WRITE_CHUNK = 250 * 60  # samples generated and written at a time
+
+
+def synthetic_ch_names(n_channels):
+    return CH_NAMES if n_channels == len(CH_NAMES) else STANDARD_NAMES[:n_channels]
+
+
+def make_synthetic(hours, n_channels, directory=SYNTHETIC_DIR, seed=0):
+    """Writes (once) a synthetic session folder: eeg_data.eegrec + stimulus log. Returns the folder.
+
+    Noise with a 10 Hz rhythm that is stronger in 'yellow' trials, a host clock that runs
+    slightly fast and bursty like BrainFlow's, and a trial every TRIAL_PERIOD seconds.
+    """
+    folder = os.path.join(directory, f'synthetic_{n_channels}ch_{hours:g}h')
+    recording_file = os.path.join(folder, 'eeg_data' + EXTENSION)
+    if os.path.exists(recording_file):
+        return folder
+    os.makedirs(folder, exist_ok=True)
+    board_id = SYNTHETIC_BOARDS[n_channels]
+    board = BoardShim.get_board_descr(board_id)
+    sfreq = board['sampling_rate']
+    n_samples = int(hours * 3600 * sfreq)
+    start_time = 1.7e9
+    rng = np.random.default_rng(seed)
+
+    onsets = np.arange(2., n_samples / sfreq - TRIAL_PERIOD, TRIAL_PERIOD)
+    colors = np.array(list(COLOR_CODES))[np.arange(len(onsets)) % len(COLOR_CODES)]
+    alpha_gain = np.ones(n_samples)
+    for onset in onsets[colors == 'yellow']:
+        alpha_gain[int(onset * sfreq):int((onset + 4) * sfreq)] = 1.5
+
+    writer = RecordingWriter(recording_file + '.tmp', board_id)
+    for start in range(0, n_samples, WRITE_CHUNK):
+        index = np.arange(start, min(start + WRITE_CHUNK, n_samples))
+        data = np.zeros((board['num_rows'], len(index)))
+        data[board['eeg_channels']] = (rng.normal(0., 10., (n_channels, len(index)))
+                                       + 8. * alpha_gain[index] * np.sin(2 * np.pi * 10. * index / sfreq))
+        data[board['package_num_channel']] = index % 256
+        # ~250.36 Hz effective rate, stamped in bursts of 10 samples like the dongle reads
+        data[board['timestamp_channel']] = start_time + (index - index % 10) / (sfreq * 1.00144)
+        writer.append(data)
+    writer.close()
+    os.replace(recording_file + '.tmp', recording_file)
+
+    pd.DataFrame({
+        'Trial': np.arange(1, len(onsets) + 1), 'Color': colors,
+        'Timestamp': start_time + onsets / 1.00144, 'Marker': np.arange(1, len(onsets) + 1),
+    }).to_csv(os.path.join(folder, STIM_LOG_FILE), index=False)
+    return folder
+
+
+def _rss_mb():
+    with open('/proc/self/statm') as file:
+        return int(file.read().split()[1]) * resource.getpagesize() / 2 ** 20
+
+
+def _max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.  # KB on Linux
+
+
+def _run_stages(folder, ch_names):
+    """Returns ((stage, function) pairs in STAGES order, state), the functions share state."""
+    state = {'event_id': session_color_codes(folder)}
+    recording_file = find_recording(folder)
+
+    def load():
+        state['raw'], state['timestamps'] = load_raw(recording_file, ch_names)
+        state['package_num'] = load_package_num(recording_file)
+
+    def events():
+        clock = ClockSync(state['timestamps'], state['package_num'])
+        stim_log = pd.read_csv(os.path.join(folder, STIM_LOG_FILE))
+        state['events'] = build_events(stim_log, clock.corrected, state['event_id'])
+
+    def filter_():
+        preprocess(state['raw'])
+
+    def epoch():
+        state['epochs'] = make_epochs(state['raw'], state['events'], state['event_id']).load_data()
+
+    def artifacts():
+        epochs = apply_artifacts(state['epochs'], detect_artifacts(state['epochs'], **ARTIFACT_PARAMS))
+        state['epochs'] = epochs
+        state['conditions'] = [c for c, code in epochs.event_id.items() if (epochs.events[:, 2] == code).any()]
+
+    def welch():
+        state['psd'] = state['epochs'].compute_psd(**WELCH_PARAMS)
+
+    def tfr():
+        state['tfr'] = morlet_band_power(state['epochs'], TFR_BANDS, TFR_TMIN, TFR_TMAX, n_cycles_per_hz=0.5)
+
+    def stats():
+        # analyze.py's tests: band means, then max-t and cluster permutations over channel x frequency
+        table = band_power_table(state['psd'])
+        for band in ('alpha', 'beta'):
+            means = [epoch_means(table, band)[c] for c in state['conditions']]
+            if len(means) == 2:
+                ttest_ind(*means)
+            else:  # a session with one condition (results/1) tests it against 0 instead
+                ttest_1samp(means[0], 0.)
+        if len(state['conditions']) == 2:  # the permutation tests need both conditions
+            first, second = (state['psd'][c].get_data() for c in state['conditions'])
+            permutation_t_test(first, second, n_permutations=N_PERMUTATIONS)
+            adjacency = feature_adjacency(first.shape[1:], channel_adjacency(state['epochs'].info))
+            cluster_permutation_test(first, second, adjacency, n_permutations=N_PERMUTATIONS)
+
+    def topomap():
+        epochs = state['epochs']
+        evokeds = [epochs[c].average() for c in state['conditions']]
+        diff = mne.combine_evoked([evokeds[0], -evokeds[1]], weights='equal') if len(evokeds) == 2 else evokeds[0]
+        fig, ax = plt.subplots(1, 1)
+        mne.viz.plot_topomap(diff.data[:, np.argmin(np.abs(diff.times - 0.3))], diff.info, axes=ax,
+                             sensors=True, contours=6, res=64, show=False)
+        fig.canvas.draw()
+        plt.close(fig)
+
+    return list(zip(STAGES, [load, events, filter_, epoch, artifacts, welch, tfr, stats, topomap])), state
+
+
+def bench_dataset(name, folder, ch_names=None):
+    """Runs every stage on one session folder, returns {'name', 'n_channels', 'hours', 'stages': {...}}."""
+    mne.set_log_level('ERROR')
+    report = {'name': name, 'folder': folder, 'stages': {}}
+    if not os.path.exists(find_recording(folder)):
+        report['skipped'] = 'no eeg_data recording'
+        return report
+
+    failed = None
+    tracemalloc.start()
+    stages, state = _run_stages(folder, ch_names)
+    for stage, run in stages:
+        if failed is not None:
+            report['stages'][stage] = {'skipped': f'{failed} failed'}
+            continue
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            run()
+        except Exception:
+            failed = stage
+            report['stages'][stage] = {'error': traceback.format_exc(limit=2).strip().splitlines()[-1]}
+            continue
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        if stage == 'load':
+            raw = state['raw']
+            report['n_channels'], report['hours'] = len(raw.ch_names), raw.n_times / raw.info['sfreq'] / 3600
+        if stage == 'artifacts':
+            report['conditions'] = state['conditions']  # the stats and topomap stages compare these
+        report['stages'][stage] = {
+            'seconds': seconds, 'peak_alloc_mb': peak / 2 ** 20,
+            'rss_mb': _rss_mb(), 'max_rss_mb': _max_rss_mb(),
+        }
+    tracemalloc.stop()
+    return report
+
+
+def _environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'host': platform.node(),
+        'python': platform.python_version(), 'numpy': np.__version__, 'mne': mne.__version__,
+    }
+
+
+def run_benchmark(participants=None, hours=HOURS, channels=CHANNELS, results_root=RESULTS_ROOT):
+    """Benchmarks the results/ sessions and the synthetic grid, returns the report dict."""
+    datasets = []
+    if participants is None:
+        participants = discover_participants(results_root)
+    for participant in participants:
+        folder = os.path.join(results_root, str(participant))
+        if os.path.isdir(folder):
+            datasets.append((f'results/{participant}', folder, None))
+    for n_channels in channels:
+        for n_hours in hours:
+            folder = make_synthetic(n_hours, n_channels)
+            datasets.append((os.path.basename(folder), folder, synthetic_ch_names(n_channels)))
+
+    report = dict(_environment(), datasets=[])
+    # One single-worker pool per dataset, a fresh process each (max_tasks_per_child needs Python 3.11)
+    context = get_context('spawn')
+    for name, folder, ch_names in datasets:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(bench_dataset, name, folder, ch_names).result()
+        report['datasets'].append(result)
+        print(format_dataset(result))
+    return report
+
+
+def format_dataset(result):
+    if 'skipped' in result:
+        return f"{result['name']}: skipped ({result['skipped']})"
+    conditions = result.get('conditions')
+    lines = [f"{result['name']}" + (f" ({', '.join(conditions)})" if conditions else '') + ':']
+    for stage, r in result['stages'].items():
+        if 'seconds' in r:
+            lines.append(f"  {stage:>9} {r['seconds']:8.3f} s  peak {r['peak_alloc_mb']:8.1f} MB  "
+                         f"max RSS {r['max_rss_mb']:7.0f} MB")
+        else:
+            lines.append(f"  {stage:>9} {r.get('error') or r.get('skipped')}")
+    return '\n'.join(lines)
+
+
+def compare(report, baseline):
+    """Per dataset and stage: (seconds new / old, peak memory new / old), as a DataFrame."""
+    def rows(rep):
+        for dataset in rep['datasets']:
+            for stage, r in dataset['stages'].items():
+                if 'seconds' in r:
+                    yield dataset['name'], stage, r['seconds'], r['peak_alloc_mb']
+    columns = ['dataset', 'stage', 'seconds', 'peak_alloc_mb']
+    new = pd.DataFrame(rows(report), columns=columns).set_index(['dataset', 'stage'])
+    old = pd.DataFrame(rows(baseline), columns=columns).set_index(['dataset', 'stage'])
+    joined = new.join(old, lsuffix='_new', rsuffix='_old', how='inner')
+    joined['time_ratio'] = joined['seconds_new'] / joined['seconds_old']
+    joined['memory_ratio'] = joined['peak_alloc_mb_new'] / joined['peak_alloc_mb_old']
+    return joined
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per-stage time and memory of the analysis pipeline')
+    parser.add_argument('participants', nargs='*', help='results/ participants (default: all)')
+    parser.add_argument('--no-results', action='store_true', help='synthetic recordings only')
+    parser.add_argument('--hours', nargs='*', type=float, default=HOURS, help='synthetic session lengths')
+    parser.add_argument('--channels', nargs='*', type=int, choices=list(SYNTHETIC_BOARDS), default=CHANNELS)
+    parser.add_argument('--json', help='write the report to this file')
+    parser.add_argument('--compare', help='earlier report to compare against')
+    args = parser.parse_args()
+
+    participants = [] if args.no_results else (args.participants or None)
+    report = run_benchmark(participants, args.hours, args.channels)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f'Report saved to: {args.json}')
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        print(f"\nCompared with {baseline.get('commit')} ({baseline.get('created')}):")
+        print(compare(report, baseline)[['seconds_old', 'seconds_new', 'time_ratio', 'memory_ratio']].round(3))
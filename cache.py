@@ -0,0 +1,114 @@
+# Imports
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+# Persistent cache for expensive analysis stages (filtered raw, epochs, PSD, TFR).
+#
+# Every stage output is stored under a key hashing the stage name, its parameters and the
+# keys of its inputs (file contents for the first stage, the parent stage key after that).
+# Changing a filter setting therefore invalidates the filtered raw and everything built on
+# it, while changing a plotting parameter invalidates nothing. Entries are evicted least
+# recently used first once the cache grows past max_bytes.
+
+CACHE_DIR = '.cache'
+MAX_BYTES = 2 * 1024 ** 3  # 2 GB
+CACHE_VERSION = 5  # bump when a stage's code changes its output
+SUFFIX = '.pkl'
+
+_file_hashes = {}  # (path, size, mtime) -> sha256, so a file is hashed once per process
+
+
+def file_hash(path):
+    """sha256 of a file's content."""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for buf in iter(lambda: file.read(1 << 20), b''):
+                digest.update(buf)
+        _file_hashes[memo_key] = digest.hexdigest()
+    return _file_hashes[memo_key]
+
+
+def stage_key(stage, params):
+    """Key for a stage output; params holds the stage settings and the keys of its inputs."""
+    payload = json.dumps([CACHE_VERSION, stage, params], sort_keys=True, default=str)
+    return f'{stage}-' + hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+class StageCache:
+    """Pickled stage outputs in a directory, LRU-evicted by total size."""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + SUFFIX)
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        """Returns the cached object or None, marking it as recently used."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                obj = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            try:
+                os.remove(path)  # unreadable entry, e.g. from an older MNE: recompute it
+            except FileNotFoundError:
+                pass
+            return None
+        try:
+            os.utime(path)  # mtime doubles as the last-used time for eviction
+        except FileNotFoundError:
+            return None  # evicted by another process since it was read: a miss, as it would be now
+        return obj
+
+    def put(self, key, obj):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as file:
+            pickle.dump(obj, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))  # readers never see a half-written entry
+        self.evict()
+
+    def get_or_compute(self, key, compute):
+        obj = self.get(key)
+        if obj is None:
+            obj = compute()
+            self.put(key, obj)
+        return obj
+
+    def evict(self, max_bytes=None):
+        """Deletes least recently used entries until the cache fits in max_bytes."""
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(SUFFIX):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue  # removed by another process since listdir
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass  # another process got there first
+            total -= size
+
+    def clear(self):
+        self.evict(max_bytes=0)
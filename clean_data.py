@@ -1,54 +1,71 @@
 # Imports
 import os
 import pandas as pd
+from brainflow.board_shim import BoardShim
 
 # Define the parent "results" folder
 root_folder = 'results'
 
-# Subfolders to process
-subfolders = [1, 2, 3, 4]
-
 # Files to process in each subfolder
 files_to_clean = ['baseline_eeg_data.csv', 'eeg_data.csv']
 
-for subfolder in subfolders:
-    for filename in files_to_clean:
-        # Build the full path to the CSV
-        file_path = os.path.join(root_folder, str(subfolder), filename)
-        
-        # Read the CSV
-        data = pd.read_csv(file_path)
-
-        # --- Begin cleaning steps ---
-            # Drop channels 8-20, timestamp and 22-23
-            # new timestamp = channel 21
-            # new channels 1-8 are 0-7
-        
-        channels_to_drop = [f'Channel_{i}' for i in range(8, 21)]
-        data_clean = data.drop(channels_to_drop, axis=1)
-
-        more_to_drop = [f'Channel_{i}' for i in range(22, 24)]
-        data_clean = data_clean.drop(more_to_drop, axis=1)
-
-        data_clean = data_clean.drop('Timestamp', axis=1)
-
-        # Renaming and rearranging
-
-        data_clean = data_clean.rename(columns={'Channel_21': 'Timestamp'})
-        rename_map = {
-            f'Channel_{i}': f'Channel_{i+1}' 
-            for i in range(8)
-        }
-        data_clean = data_clean.rename(columns=rename_map)
-
-        new_order = ['Timestamp'] + [f'Channel_{i}' for i in range(1, 9)]
-        data_clean = data_clean[new_order]
-
-        # --- End cleaning steps ---
-
-        # Save the cleaned DataFrame to a new file
-        cleaned_filename = os.path.splitext(filename)[0] + '_cleaned.csv'
-        cleaned_file_path = os.path.join(root_folder, str(subfolder), cleaned_filename)
-        data_clean.to_csv(cleaned_file_path, index=False)
-        
-        print(f'Cleaned file saved to: {cleaned_file_path}')
+# Board the CSVs were recorded with, 0 = Cyton without daisy
+CYTON_BOARD_ID = 0
+
+# Rows read per chunk, memory use stays constant whatever the session length
+CHUNK_SIZE = 25000
+
+
+def cleaned_path(file_path):
+    return os.path.splitext(file_path)[0] + '_cleaned.csv'
+
+
+def is_up_to_date(file_path, cleaned_file_path):
+    """True if the cleaned file exists and is newer than the raw recording."""
+    return (os.path.exists(cleaned_file_path)
+            and os.path.getmtime(cleaned_file_path) >= os.path.getmtime(file_path))
+
+
+def clean_file(file_path, cleaned_file_path=None, board_id=CYTON_BOARD_ID, chunk_size=CHUNK_SIZE, force=False):
+    """Streams a raw BrainFlow CSV into Timestamp + Channel_1..N, returns the output path or None if skipped.
+
+    Column k of the raw CSV holds BrainFlow row k (the header names are shifted by one:
+    'Timestamp' is the package counter and 'Channel_21' the real timestamp on the Cyton),
+    so the EEG and timestamp columns come straight from the board description.
+    """
+    if cleaned_file_path is None:
+        cleaned_file_path = cleaned_path(file_path)
+    if not force and is_up_to_date(file_path, cleaned_file_path):
+        return None
+
+    board = BoardShim.get_board_descr(board_id)
+    header = pd.read_csv(file_path, nrows=0).columns
+    timestamp_col = header[board['timestamp_channel']]
+    eeg_cols = [header[row] for row in board['eeg_channels']]
+    new_names = {timestamp_col: 'Timestamp'}
+    new_names.update({col: f'Channel_{i + 1}' for i, col in enumerate(eeg_cols)})
+    new_order = ['Timestamp'] + [f'Channel_{i + 1}' for i in range(len(eeg_cols))]
+
+    # Write to a temporary file so an interrupted run never looks up to date
+    tmp_path = cleaned_file_path + '.tmp'
+    chunks = pd.read_csv(file_path, usecols=[timestamp_col] + eeg_cols, chunksize=chunk_size)
+    for i, chunk in enumerate(chunks):
+        chunk = chunk.rename(columns=new_names)[new_order]
+        chunk.to_csv(tmp_path, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+    os.replace(tmp_path, cleaned_file_path)
+    return cleaned_file_path
+
+
+if __name__ == '__main__':
+    for subfolder in sorted(os.listdir(root_folder)):
+        for filename in files_to_clean:
+            # Build the full path to the CSV
+            file_path = os.path.join(root_folder, subfolder, filename)
+            if not os.path.exists(file_path):
+                continue
+
+            cleaned_file_path = clean_file(file_path)
+            if cleaned_file_path is None:
+                print(f'Up to date, skipped: {file_path}')
+            else:
+                print(f'Cleaned file saved to: {cleaned_file_path}')
@@ -0,0 +1,238 @@
+# Imports
+import argparse
+import json
+import os
+import time
+
+import mne
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.model_selection import StratifiedKFold
+
+from bandpower import BANDS, band_power
+from batch import discover_participants
+from cache import stage_key
+from features import Session
+from group import GROUP_DIR
+from loader import find_recording
+
+# Single-trial decoding of the condition (yellow vs blue) from the epochs of one participant:
+#   python decoding.py                                 # every results/<id>/, plus the group
+#   python decoding.py 4 --features bandpower --permutations 5000 --workers 4
+#
+# Three feature sets, built once per participant from the clean epochs and cached like the
+# analysis stages:
+#   bandpower   log10 Welch band power per channel and band
+#   covariance  log-Euclidean vector (upper triangle of the matrix log) of the shrunk spatial
+#               covariance over 0-4 s
+#   timecourse  the epoch averaged in 1 / TIMECOURSE_SFREQ s bins, every channel
+# The classifier is scikit-learn's StandardScaler + RidgeClassifier written out in closed
+# form: within a fold the training features are the same for every labelling, so the true
+# labels and all their shuffles are fitted with one linear solve, like the label matrices of
+# stats.py. Accuracy is the balanced accuracy of the pooled out-of-fold predictions, and the
+# chance level is read from the shuffled labellings instead of assumed to be 50%. Folds run
+# as parallel joblib jobs. Across participants, the group mean accuracy is compared with
+# means of one random null accuracy per participant.
+
+FEATURE_SETS = ['bandpower', 'covariance', 'timecourse']
+TIMECOURSE_SFREQ = 10.  # Hz after binning: 40 samples per channel for 0-4 s
+COV_SHRINKAGE = 0.1  # weight of the scaled identity mixed into each covariance
+RIDGE_ALPHA = 1.  # RidgeClassifier's default
+N_SPLITS = 5
+N_PERMUTATIONS = 1000
+N_GROUP_NULL = 10000
+SEED = 0
+CHANCE_QUANTILE = 0.95  # the reported chance level: this quantile of the null accuracies
+DECODING_FILE = 'decoding.json'
+GROUP_FILE = 'decoding.csv'
+
+
+#### Features ####
+
+def covariance_features(data, shrinkage=COV_SHRINKAGE):
+    """Log-Euclidean vectors of the (n_epochs, n_channels, n_times) epochs' covariance matrices."""
+    data = data - data.mean(axis=-1, keepdims=True)
+    cov = data @ data.transpose(0, 2, 1) / data.shape[-1]
+    n_channels = cov.shape[-1]
+    trace = np.trace(cov, axis1=1, axis2=2)[:, None, None] / n_channels
+    cov = (1 - shrinkage) * cov + shrinkage * trace * np.eye(n_channels)
+    # Matrix log of every epoch at once through its eigendecomposition
+    values, vectors = np.linalg.eigh(cov)
+    log_cov = (vectors * np.log(values)[:, None, :]) @ vectors.transpose(0, 2, 1)
+    rows, cols = np.triu_indices(n_channels)
+    weights = np.where(rows == cols, 1., np.sqrt(2.))  # keeps the Frobenius norm of the matrix
+    return log_cov[:, rows, cols] * weights
+
+
+def timecourse_features(data, sfreq, bin_sfreq=TIMECOURSE_SFREQ):
+    """(n_epochs, n_channels * n_bins) means of consecutive 1 / bin_sfreq s windows."""
+    size = max(1, int(round(sfreq / bin_sfreq)))
+    n_bins = data.shape[-1] // size
+    binned = data[..., :n_bins * size].reshape(*data.shape[:-1], n_bins, size).mean(axis=-1)
+    return binned.reshape(len(data), -1)
+
+
+def epoch_features(epochs, spectrum, bands=BANDS):
+    """{feature set: (n_epochs, n_features)} and the condition labels (0/1, ordered by event code)."""
+    codes = epochs.events[:, 2]
+    classes = np.unique(codes)
+    if len(classes) != 2:
+        raise ValueError(f'Decoding needs two conditions, the epochs have event codes {classes.tolist()}')
+    data = epochs.get_data(tmin=0.)
+    power = band_power(spectrum.get_data(), spectrum.freqs, bands)
+    return {
+        'bandpower': np.log10(power).reshape(len(power), -1),
+        'covariance': covariance_features(data),
+        'timecourse': timecourse_features(data, epochs.info['sfreq']),
+    }, (codes == classes[1]).astype(int)
+
+
+def session_features(session):
+    """epoch_features of a Session's clean epochs, cached next to its other stages."""
+    key = stage_key('decoding_features', {
+        'epochs': session.epochs_key, 'psd': session.psd_key, 'bands': BANDS,
+        'timecourse_sfreq': TIMECOURSE_SFREQ, 'cov_shrinkage': COV_SHRINKAGE,
+    })
+    return session.cache.get_or_compute(key, lambda: epoch_features(session.epochs(), session.psd()))
+
+
+#### Cross-validation with permutations ####
+
+def fold_decisions(X, labels, train, test, alpha=RIDGE_ALPHA):
+    """Ridge decision values of the test epochs for every labelling: (n_labellings, n_test).
+
+    The fit of StandardScaler + RidgeClassifier(alpha) on each row of labels (0/1), all rows
+    in one solve; the n_train x n_train (dual) system is used when features outnumber epochs.
+    """
+    mean, std = X[train].mean(axis=0), X[train].std(axis=0)
+    std[std == 0] = 1.
+    x_train, x_test = (X[train] - mean) / std, (X[test] - mean) / std
+    targets = 2. * labels[:, train] - 1.  # RidgeClassifier regresses on -1/+1
+    offsets = targets.mean(axis=1, keepdims=True)
+    targets = (targets - offsets).T  # centred (n_train, n_labellings): the intercept is the offset
+    n_train, n_features = x_train.shape
+    if n_features <= n_train:
+        weights = np.linalg.solve(x_train.T @ x_train + alpha * np.eye(n_features), x_train.T @ targets)
+    else:
+        weights = x_train.T @ np.linalg.solve(x_train @ x_train.T + alpha * np.eye(n_train), targets)
+    return (x_test @ weights).T + offsets
+
+
+def balanced_accuracy(labels, predictions):
+    """Balanced accuracy of every row of (n_labellings, n_epochs) 0/1 labels and predictions."""
+    hits = labels == predictions
+    positive = labels == 1
+    return 0.5 * ((hits & positive).sum(axis=1) / positive.sum(axis=1)
+                  + (hits & ~positive).sum(axis=1) / (~positive).sum(axis=1))
+
+
+def permutation_scores(X, y, n_permutations=N_PERMUTATIONS, n_splits=N_SPLITS, alpha=RIDGE_ALPHA, seed=SEED,
+                       parallel=None):
+    """Cross-validated balanced accuracy of y and of n_permutations shuffles of it.
+
+    Returns (accuracy, null accuracies). Every labelling uses the same stratified folds; each
+    fold is one job of the joblib parallel (sequential when None).
+    """
+    n_splits = min(n_splits, np.bincount(y).min())
+    if n_splits < 2:
+        raise ValueError(f'Too few epochs per condition to cross-validate: {np.bincount(y).tolist()}')
+    folds = list(StratifiedKFold(n_splits, shuffle=True, random_state=seed).split(X, y))
+    rng = np.random.default_rng(seed)
+    labels = np.vstack([y] + [rng.permutation(y) for _ in range(n_permutations)])
+    decisions = (parallel or Parallel(n_jobs=1))(
+        delayed(fold_decisions)(X, labels, train, test, alpha) for train, test in folds)
+    predictions = np.empty_like(labels)
+    for (_, test), decision in zip(folds, decisions):
+        predictions[:, test] = decision > 0
+    scores = balanced_accuracy(labels, predictions)
+    return scores[0], scores[1:]
+
+
+def _result(accuracy, null):
+    return {
+        'accuracy': float(accuracy),
+        'chance': float(np.quantile(null, CHANCE_QUANTILE)),
+        'null_mean': float(null.mean()),
+        # The observed labelling counts as one of the permutations, so p is never 0
+        'p': float((1 + (null >= accuracy).sum()) / (1 + len(null))),
+    }
+
+
+def decode_participant(folder, feature_sets=FEATURE_SETS, n_permutations=N_PERMUTATIONS, seed=SEED,
+                       parallel=None, cache=None):
+    """Scores every feature set of one participant; returns {feature set: result} with the null accuracies."""
+    features, y = session_features(Session(folder, cache))
+    results = {}
+    for feature_set in feature_sets:
+        accuracy, null = permutation_scores(features[feature_set], y, n_permutations, seed=seed, parallel=parallel)
+        results[feature_set] = dict(_result(accuracy, null), n_epochs=len(y),
+                                    n_features=features[feature_set].shape[1], null=null)
+    return results
+
+
+def group_test(accuracies, nulls, n_draws=N_GROUP_NULL, seed=SEED):
+    """Mean accuracy over participants against means of one random null accuracy per participant."""
+    rng = np.random.default_rng(seed)
+    draws = np.stack([null[rng.integers(len(null), size=n_draws)] for null in nulls])
+    return _result(np.mean(accuracies), draws.mean(axis=0))
+
+
+def run_decoding(root_folder='results', participants=None, feature_sets=FEATURE_SETS,
+                 n_permutations=N_PERMUTATIONS, n_jobs=None, group_dir=GROUP_DIR):
+    """Decodes every participant, saves results/<id>/decoding.json and group/decoding.csv, returns the table."""
+    if participants is None:
+        participants = discover_participants(root_folder)
+    rows, nulls = [], {feature_set: [] for feature_set in feature_sets}
+    # One pool for every participant, so workers start once
+    with Parallel(n_jobs=n_jobs or -1) as parallel:
+        for participant in participants:
+            folder = os.path.join(root_folder, str(participant))
+            if not os.path.exists(find_recording(folder)):
+                continue  # baseline-only session
+            start = time.perf_counter()
+            try:
+                results = decode_participant(folder, feature_sets, n_permutations, parallel=parallel)
+            except Exception as error:
+                print(f'{participant}: FAILED ({error})')
+                continue
+            saved = {feature_set: {k: v for k, v in result.items() if k != 'null'}
+                     for feature_set, result in results.items()}
+            with open(os.path.join(folder, DECODING_FILE), 'w') as file:
+                json.dump({'n_permutations': n_permutations, 'results': saved}, file, indent=2)
+            for feature_set, result in results.items():
+                nulls[feature_set].append(result['null'])
+                rows.append(dict(participant=str(participant), features=feature_set, **saved[feature_set]))
+            print(f'{participant}: decoded in {time.perf_counter() - start:.1f} s')
+
+    if not rows:
+        print('No participant could be decoded')
+        return pd.DataFrame(rows)
+    table = pd.DataFrame(rows)
+    for feature_set in feature_sets:
+        accuracies = table.loc[table['features'] == feature_set, 'accuracy']
+        if len(accuracies) > 1:
+            rows.append(dict(participant='group', features=feature_set, n_participants=len(accuracies),
+                             **group_test(accuracies, nulls[feature_set])))
+    table = pd.DataFrame(rows)
+    os.makedirs(group_dir, exist_ok=True)
+    table.to_csv(os.path.join(group_dir, GROUP_FILE), index=False)
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cross-validated yellow vs blue decoding with permutation chance levels')
+    parser.add_argument('participants', nargs='*', help='participant ids (default: every folder in root)')
+    parser.add_argument('--root', default='results')
+    parser.add_argument('--features', nargs='+', choices=FEATURE_SETS, default=FEATURE_SETS)
+    parser.add_argument('--permutations', type=int, default=N_PERMUTATIONS)
+    parser.add_argument('--workers', type=int, default=None, help='parallel folds (default: CPU count)')
+    parser.add_argument('--group-dir', default=GROUP_DIR)
+    args = parser.parse_args()
+
+    mne.set_log_level('WARNING')
+    table = run_decoding(args.root, args.participants or None, args.features, args.permutations, args.workers,
+                         args.group_dir)
+    if not table.empty:
+        columns = ['participant', 'features', 'accuracy', 'chance', 'p']
+        print(table[columns].to_string(index=False, float_format=lambda x: f'{x:.3f}'))
@@ -0,0 +1,89 @@
+# Imports
+import json
+import os
+import warnings
+
+import numpy as np
+
+# Condition name (as written by stim_cleanup.py) --> mne event code, for sessions recorded
+# before the config files; a session's own codes come from session_color_codes()
+COLOR_CODES = {'yellow': 1, 'blue': 2}
+SESSION_CONFIG_FILE = 'session_config.json'  # written by experiment.py next to the data
+
+
+def session_config(folder):
+    """The config a session ran with, None for sessions recorded before the config files."""
+    path = os.path.join(folder, SESSION_CONFIG_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def session_color_codes(folder):
+    """Condition name --> event code of a session: its config's conditions numbered from 1, in order."""
+    config = session_config(folder)
+    if config is None:
+        return COLOR_CODES
+    return {name: code for code, name in enumerate(config['conditions'], start=1)}
+
+
+def nearest_samples(timestamps, times):
+    """Index of the recorded EEG timestamp closest to each time, in one searchsorted pass."""
+    idx = np.searchsorted(timestamps, times)
+    idx = np.clip(idx, 1, len(timestamps) - 1)
+    left, right = timestamps[idx - 1], timestamps[idx]
+    return idx - ((times - left) <= (right - times))  # step back where the left neighbour is closer
+
+
+def condition_codes(conditions, color_codes=COLOR_CODES):
+    """Maps condition names to event codes, failing on NaN or unmapped conditions."""
+    conditions = np.asarray(conditions, dtype=object)
+    names = np.array(list(color_codes), dtype=object)
+    codes = np.array(list(color_codes.values()), dtype=int)
+    matches = conditions[:, None] == names[None, :]  # NaN never matches anything
+    unmapped = ~matches.any(axis=1)
+    if unmapped.any():
+        bad = sorted({str(c) for c in conditions[unmapped]})
+        raise ValueError(f"{unmapped.sum()} stimuli have no event code (conditions {bad}, "
+                         f"rows {np.flatnonzero(unmapped).tolist()}); known: {list(color_codes)}")
+    return codes[matches.argmax(axis=1)]
+
+
+def coded_trials(stim_log, color_codes=COLOR_CODES):
+    """Rows of the stimulus log whose Color has an event code; the others are left out with a warning.
+
+    Sessions can hold trials of conditions without a code (NaN or e.g. 'red' in results/1),
+    which have no place in the events array. Raises only when no trial is left.
+    """
+    coded = stim_log['Color'].isin(list(color_codes)).to_numpy()
+    if not coded.any():
+        raise ValueError(f"No stimulus has an event code (conditions {sorted({str(c) for c in stim_log['Color']})}); "
+                         f"known: {list(color_codes)}")
+    if not coded.all():
+        skipped = stim_log[~coded]
+        warnings.warn(f"{len(skipped)} of {len(stim_log)} stimuli have no event code and are left out "
+                      f"(conditions {sorted({str(c) for c in skipped['Color']})}, rows {np.flatnonzero(~coded).tolist()})")
+    return stim_log[coded]
+
+
+def build_events(stim_log, timestamps, color_codes=COLOR_CODES):
+    """Turns the cleaned stimulus log into an mne events array.
+
+    Each onset is snapped to the nearest recorded EEG timestamp instead of being counted
+    from t0 at the nominal sampling rate, so dropped samples don't shift later events.
+    Stimuli without an event code are left out (see coded_trials), stimuli outside the
+    recording are rejected.
+    """
+    stim_log = coded_trials(stim_log, color_codes)
+    timestamps = np.asarray(timestamps)
+    stim_times = stim_log['Timestamp'].to_numpy(dtype=float)
+    outside = (stim_times < timestamps[0]) | (stim_times > timestamps[-1])
+    if outside.any():
+        raise ValueError(f"{outside.sum()} stimuli fall outside the EEG recording "
+                         f"(rows {np.flatnonzero(outside).tolist()})")
+
+    events = np.zeros((len(stim_log), 3), dtype=int)
+    events[:, 0] = nearest_samples(timestamps, stim_times)
+    events[:, 2] = condition_codes(stim_log['Color'].to_numpy(), color_codes)
+    return events
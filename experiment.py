@@ -0,0 +1,351 @@
+# Imports
+import argparse
+import copy
+import csv
+import json
+import os
+import random
+from pprint import pprint
+
+from brainflow.board_shim import BoardIds, BoardShim, BrainFlowInputParams
+from psychopy import core, event, monitors, visual
+from pylsl import StreamInfo, StreamOutlet
+
+from events import SESSION_CONFIG_FILE
+from lsl_recorder import MARKER_SOURCE_ID, BoardLSLPublisher, LSLRecorder
+from monitor import OnlineMonitor
+from port_discovery import find_openbci_port
+from recorder import StreamRecorder
+from scheduler import FrameScheduler
+from word_pool import load_pool
+
+# Experiment engine: one session = one JSON config, e.g.
+#   python experiment.py configs/v2_background.json
+#   python experiment.py configs/v1_text.json --participant 7
+#
+# The config only has to list what differs from DEFAULT_CONFIG. Everything random (words,
+# memory test items) is drawn before the window opens, with the same random calls in the same
+# order as the original scripts, so seed 42 still gives the same words. Every stimulus is
+# created during setup; the trial loop and the memory test only draw them.
+
+CONFIG_DIR = 'configs'
+RESULTS_ROOT = 'results'
+
+DEFAULT_CONFIG = {
+    'name': 'colored_background',
+    'n_trials': 100,
+    'seed': 42,
+    # Condition name --> #HEX, in presentation order (trials cycle through them)
+    'conditions': {'yellow': '#F1E05C', 'blue': '#A6D5FF'},
+    'color_mode': 'background',  # 'background': colored screen + black word, 'text': colored word
+    'durations': {
+        'fixation': 0.,  # crosshair before the word, 0 to skip
+        'word': 4.0,
+        'blank': 0.5,
+        'iti': 1.0,
+        'baseline': 30.,
+        'message': 3.,
+        'instructions': 5.,
+        'results': 5.,
+    },
+    'memory_test': {
+        'n_presented': 15,
+        'n_foils': 5,
+        'question': "Did you see the word '{word}' with a {color} background? (Y/N)",
+    },
+    'board_id': None,  # None: Cyton if the dongle is found, else the synthetic board
+    'monitor': 'DELL SE2422HX',
+    'window_size': [1920, 1080],
+    'lsl_recording': True,  # session.lslrec, see lsl_recorder.py
+    'online_monitor': True,  # console signal-quality warnings, see monitor.py
+}
+
+# Cyton board setup
+CYTON_BOARD_ID = 0  # 0 if no daisy, 2 if using daisy board, 6 if using daisy + WiFi shield
+SYNTHETIC_BOARD_ID = BoardIds.SYNTHETIC_BOARD.value
+ANALOGUE_MODE = '/2'  # Reads from analog pins A5(D11), A6(D12), and A7(D13) if no WiFi shield is present.
+BOARD_COMMANDS = ['/0', '//', ANALOGUE_MODE]
+RECORDER_CHUNK = 50  # samples per drain, 0.2 s at 250 Hz, so the monitor updates a few times a second
+
+BASELINE_START, BASELINE_END = 999, 1000  # LSL markers around the baseline
+STIM_LOG_HEADER = ["Trial", "Word", "Color", "Condition", "Timestamp", "Marker", "WordDuration", "DroppedFrames"]
+MEMORY_LOG_HEADER = ["Word", "Color", "Response", "Accuracy"]
+
+
+def _merge(defaults, overrides):
+    merged = copy.deepcopy(defaults)
+    for key, value in overrides.items():
+        if key not in defaults:
+            raise ValueError(f"Unknown config key '{key}', known: {list(defaults)}")
+        if isinstance(defaults[key], dict) and key != 'conditions':
+            merged[key] = _merge(defaults[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_config(path):
+    """Reads a session config and fills in DEFAULT_CONFIG for everything it leaves out."""
+    with open(path) as file:
+        config = _merge(DEFAULT_CONFIG, json.load(file))
+    if config['color_mode'] not in ('background', 'text'):
+        raise ValueError(f"color_mode must be 'background' or 'text', not {config['color_mode']!r}")
+    if len(config['conditions']) < 2:
+        raise ValueError('A session needs at least two conditions')
+    return config
+
+
+def build_schedule(config, pool):
+    """Draws the trials and the memory test items, returns (trials, memory_items).
+
+    trials: dicts with trial, word, condition, color and marker; memory_items: (word, color)
+    pairs, presented or not.
+    """
+    rng = random.Random(config['seed'])
+    conditions = list(config['conditions'])
+    colors = list(config['conditions'].values())
+
+    words = rng.sample(pool, config['n_trials'])
+    rng.shuffle(words)
+    trials = [
+        {'trial': i + 1, 'word': word, 'condition': conditions[i % len(colors)],
+         'color': colors[i % len(colors)], 'marker': i + 1}  # marker = trial number
+        for i, word in enumerate(words)
+    ]
+
+    memory = config['memory_test']
+    memory_items = []
+    for trial in rng.sample(trials, memory['n_presented']):
+        if rng.choice([True, False]):  # 50% chance of the correct color
+            memory_items.append((trial['word'], trial['color']))
+        else:
+            memory_items.append((trial['word'], rng.choice([c for c in colors if c != trial['color']])))
+    # Foils: words that weren't presented, with random colors
+    presented = set(words)
+    foils = rng.sample([word for word in pool if word not in presented], memory['n_foils'])
+    memory_items += [(word, rng.choice(colors)) for word in foils]
+    rng.shuffle(memory_items)
+    return trials, memory_items
+
+
+def connect_board(board_id=None):
+    """Prepares the BrainFlow session, returns (board, board_id)."""
+    params = BrainFlowInputParams()
+    if board_id is None:
+        detected_port = find_openbci_port()  # probes ports concurrently, last good port first
+        if detected_port is None:
+            print("OpenBCI port not found, proceeding with a synthetic board.")
+            board_id = SYNTHETIC_BOARD_ID
+        else:
+            board_id = CYTON_BOARD_ID
+            params.serial_port = detected_port
+    elif board_id == CYTON_BOARD_ID:
+        params.serial_port = find_openbci_port()
+    if board_id == 6:
+        params.ip_port = 9000  # WiFi shield
+    pprint(BoardShim.get_board_descr(board_id))
+
+    board = BoardShim(board_id, params)
+    try:
+        board.prepare_session()
+        # Configure board only if it's the actual Cyton (not synthetic)
+        if board_id == CYTON_BOARD_ID:
+            for command in BOARD_COMMANDS:
+                print(board.config_board(command))
+    except Exception as e:
+        print(f"Error initializing OpenBCI: {e}")
+        core.quit()
+    return board, board_id
+
+
+class Experiment:
+    """One session of the word/color experiment, as described by a config.
+
+    Usage:
+        experiment = Experiment(load_config('configs/v2_background.json'), participant_id='7')
+        experiment.run()
+    """
+
+    def __init__(self, config, participant_id, results_root=RESULTS_ROOT):
+        self.config = config
+        self.results_folder = os.path.join(results_root, str(participant_id))
+        os.makedirs(self.results_folder, exist_ok=True)
+        self.pool = load_pool()
+        self.trials, self.memory_items = build_schedule(config, self.pool)
+        self.color_names = {color: name for name, color in config['conditions'].items()}
+        # The config the session actually ran with, next to its data
+        with open(self._path(SESSION_CONFIG_FILE), 'w') as file:
+            json.dump(config, file, indent=2)
+
+    def _path(self, filename):
+        return os.path.join(self.results_folder, filename)
+
+    #### Setup ####
+
+    def setup(self):
+        self.board, self.board_id = connect_board(self.config['board_id'])
+        self.outlet = StreamOutlet(StreamInfo('Markers', 'Markers', 1, 0, 'int32', MARKER_SOURCE_ID))
+        self.listeners = []
+        self.lsl_recorder = self.online_monitor = None
+        if self.config['lsl_recording']:
+            # EEG republished on LSL and recorded together with the markers, both on the LSL clock
+            publisher = BoardLSLPublisher(self.board_id)
+            self.listeners.append(publisher.push)
+            self.lsl_recorder = LSLRecorder(self._path('session.lslrec'),
+                                            {'EEG': publisher.source_id, 'Markers': MARKER_SOURCE_ID})
+            self.lsl_recorder.start()
+        if self.config['online_monitor']:
+            self.online_monitor = OnlineMonitor(self.board_id, log_file=self._path('monitor_log.csv'))
+            self.online_monitor.start()
+            self.listeners.append(self.online_monitor.push)
+
+        mon = monitors.Monitor(self.config['monitor'])  # fetch the most recent calib for this monitor
+        mon.save()
+        self.win = visual.Window(size=self.config['window_size'], color='white', units='pix', monitor=mon)
+        self.scheduler = FrameScheduler(self.win, self.outlet)
+        self._make_stims()
+
+    def _text(self, text, height=30, color='black'):
+        return visual.TextStim(self.win, text=text, color=color, height=height)
+
+    def _make_stims(self):
+        """Every stimulus of the session, so nothing is laid out while the clock runs."""
+        durations, memory = self.config['durations'], self.config['memory_test']
+        self.crosshair = self._text('+', height=60)
+        self.messages = {
+            'baseline': self._text(f"Starting {durations['baseline']:.0f}-second baseline EEG data collection..."),
+            'baseline_complete': self._text("Baseline EEG data collection complete. Starting the main experiment..."),
+            'instructions': self._text("You will see words in different colors. Focus on both the word and the color."),
+            'memory_instructions': self._text("Now, you will be asked if you saw certain words in specific colors. "
+                                              "Respond with 'Y' for Yes or 'N' for No."),
+        }
+        text_colored = self.config['color_mode'] == 'text'
+        backgrounds = {
+            color: visual.Rect(self.win, width=self.win.size[0], height=self.win.size[1], units='pix',
+                               lineColor=None, fillColor=color)
+            for color in self.config['conditions'].values()
+        }
+        self.trial_stims = []
+        for trial in self.trials:
+            word = self._text(trial['word'], height=40, color=trial['color'] if text_colored else 'black')
+            self.trial_stims.append([word] if text_colored else [backgrounds[trial['color']], word])
+        self.questions = [
+            self._text(memory['question'].format(word=word, color=self.color_names[color]))
+            for word, color in self.memory_items
+        ]
+
+    def _recorder(self, filename):
+        return StreamRecorder(self.board, self.board_id, self._path(filename), chunk_size=RECORDER_CHUNK,
+                              poll_interval=0.05, listeners=self.listeners)
+
+    def _message(self, name, seconds):
+        self.scheduler.show([self.messages[name]], seconds)
+
+    #### Session ####
+
+    def run_baseline(self):
+        durations = self.config['durations']
+        self._message('baseline', durations['message'])
+        self.outlet.push_sample([BASELINE_START])
+        # Baseline EEG data is written to disk by a background recorder while it streams
+        recorder = self._recorder('baseline_eeg_data.eegrec')
+        self.board.start_stream()
+        recorder.start()
+        self.scheduler.show([self.crosshair], durations['baseline'])
+        # Stop the EEG stream after baseline collection and flush the rest of the baseline to disk
+        self.board.stop_stream()
+        self.outlet.push_sample([BASELINE_END])
+        recorder.stop()
+        self._message('baseline_complete', durations['message'])
+
+    def run_trials(self):
+        durations = self.config['durations']
+        with open(self._path('stimulus_log.csv'), mode='w', newline='') as file:
+            writer = csv.writer(file)
+            # Timestamp is the measured flip onset (time.time() clock), WordDuration the measured time
+            # until the blank screen replaced the word, DroppedFrames the frames PsychoPy missed in the trial
+            writer.writerow(STIM_LOG_HEADER)
+            self._message('instructions', durations['instructions'])
+
+            # EEG for the main experiment, streamed to disk in chunks
+            recorder = self._recorder('eeg_data.eegrec')
+            self.board.start_stream()
+            recorder.start()
+
+            for trial, stims in zip(self.trials, self.trial_stims):
+                dropped = 0
+                if durations['fixation'] > 0:
+                    dropped += self.scheduler.show([self.crosshair], durations['fixation'])['dropped']
+                # The word (and its background) appear on the flip that sends the marker
+                word = self.scheduler.show(stims, durations['word'], marker=trial['marker'])
+                blank = self.scheduler.show([self.crosshair], durations['blank'])
+                iti = self.scheduler.show([self.crosshair], durations['iti'])
+                dropped += word['dropped'] + blank['dropped'] + iti['dropped']
+                writer.writerow([trial['trial'], trial['word'], trial['color'], trial['condition'], word['onset'],
+                                 trial['marker'], blank['onset'] - word['onset'], dropped])
+
+            # Stop EEG data collection after the experiment, only the last chunk is left to write
+            self.board.stop_stream()
+            recorder.stop()
+
+    def run_memory_test(self):
+        durations = self.config['durations']
+        self._message('memory_instructions', durations['instructions'])
+        presented = {(trial['word'], trial['color']) for trial in self.trials}
+        correct_responses = 0
+        memory_test_results = []
+        for (word, color), question in zip(self.memory_items, self.questions):
+            question.draw()
+            self.win.flip()
+            response = event.waitKeys(keyList=['y', 'n', 'escape'])[0]
+            if response == 'escape':
+                self.close()
+                core.quit()
+            correct = (response == 'y') == ((word, color) in presented)
+            correct_responses += correct
+            memory_test_results.append((word, self.color_names[color], response, "Correct" if correct else "Incorrect"))
+
+        with open(self._path('memory_test_results.csv'), mode='w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(MEMORY_LOG_HEADER)
+            writer.writerows(memory_test_results)
+
+        # The only stim that depends on the answers
+        results = self._text(f"Memory test complete. You got {correct_responses} out of {len(self.memory_items)} correct.")
+        self.scheduler.show([results], durations['results'])
+        return correct_responses
+
+    def close(self):
+        if self.lsl_recorder is not None:
+            self.lsl_recorder.stop()
+            self.lsl_recorder = None
+        if self.online_monitor is not None:
+            self.online_monitor.stop()
+            self.online_monitor = None
+        if self.board.is_prepared():
+            self.board.release_session()
+
+    def run(self):
+        self.setup()
+        self.run_baseline()
+        self.run_trials()
+        self.close()  # EEG is done, the memory test is behaviour only
+        self.run_memory_test()
+        print("Experiment complete. Data saved.")
+        self.win.close()
+        core.quit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Runs one session of the word/color EEG experiment.')
+    parser.add_argument('config', help=f'session config, e.g. {CONFIG_DIR}/v2_background.json')
+    parser.add_argument('--participant', help='participant ID (asked for if not given)')
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    participant_id = args.participant or input("Enter participant ID: ")
+    Experiment(config, participant_id).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+# Imports
+import os
+
+import mne
+import numpy as np
+import pandas as pd
+
+from artifacts import (BAD_CHANNEL_FRACTION, BLINK_UV, FLAT_UV, PTP_LIMIT_UV, Z_LIMIT, apply_artifacts,
+                       detect_artifacts)
+from bandpower import BANDS, band_power_table, morlet_band_power, tidy_table
+from baseline import BASELINE_NAME, NORMALIZATIONS, normalize_table, resting_stats
+from cache import StageCache, file_hash, stage_key
+from events import COLOR_CODES, build_events, session_color_codes
+from filters import H_FREQ, L_FREQ, NOTCH_FREQS
+from loader import CH_NAMES, find_recording, load_package_num, load_raw, load_recording
+from lsl_recorder import marker_events, read_lsl_recording
+from sync import ClockSync
+
+# Analysis stages shared by analyze.py (interactive) and batch.py (unattended)
+
+EVENT_ID = COLOR_CODES  # sessions recorded before the config files; Session.event_id is the session's
+TMIN, TMAX = -0.3, 4.
+BETA_BAND = (13, 30)
+TFR_BANDS = {'beta': BETA_BAND}
+TFR_TMIN, TFR_TMAX = 0., 4.
+FEATURES_FILE = 'features.csv'
+STIM_LOG_FILE = 'stimulus_log_cleaned.csv'
+LSL_FILE = 'session.lslrec'  # EEG + markers on the LSL clock, see lsl_recorder.py
+
+WELCH_PARAMS = dict(method='welch', fmin=1, fmax=45, n_fft=512, n_overlap=256)
+TFR_FREQS = np.arange(2, 45, 1)
+TFR_N_CYCLES = TFR_FREQS / 2.
+ARTIFACT_PARAMS = dict(ptp_limit=PTP_LIMIT_UV, flat=FLAT_UV, z_limit=Z_LIMIT, blink=BLINK_UV,
+                       bad_fraction=BAD_CHANNEL_FRACTION)
+
+
+def load_session(folder):
+    """Loads a participant folder, returns (raw, events)."""
+    recording_file = find_recording(folder)
+    raw, timestamps = load_raw(recording_file)
+    stim_log = pd.read_csv(os.path.join(folder, STIM_LOG_FILE))
+    clock = ClockSync(timestamps, load_package_num(recording_file))
+    events = build_events(stim_log, clock.corrected, session_color_codes(folder))
+    return raw, events
+
+
+def preprocess(raw):
+    """Powerline notch + 1-45 Hz band-pass, in place."""
+    raw.notch_filter(freqs=NOTCH_FREQS) # notch filter freq for US powerline
+    raw.filter(l_freq=L_FREQ, h_freq=H_FREQ) # high pass & low pass
+    return raw
+
+
+def make_epochs(raw, events, event_id=EVENT_ID):
+    return mne.Epochs(
+        raw,
+        events,
+        event_id=event_id,
+        tmin=TMIN,
+        tmax=TMAX,
+        baseline=(TMIN, 0),
+        reject_by_annotation=True,
+        on_missing='warn'  # sessions with one condition only (results/1) still epoch
+    )
+
+
+class Session:
+    """The analysis stages of one participant folder, computed lazily and cached on disk.
+
+    Each stage is keyed by its parameters and the key of the stage it is built from, down to
+    the content hash of the recording and stimulus log, so a rerun only recomputes what an
+    edit actually invalidated. Asking for the PSD of a fully cached session loads the PSD
+    only, never the raw data or the epochs.
+    """
+
+    def __init__(self, folder, cache=None):
+        self.folder = folder
+        self.recording_file = find_recording(folder)
+        self.stim_log_file = os.path.join(folder, STIM_LOG_FILE)
+        self.lsl_file = os.path.join(folder, LSL_FILE)
+        if not os.path.exists(self.lsl_file):
+            self.lsl_file = None  # sessions recorded before the LSL recorder
+        self.baseline_file = find_recording(folder, BASELINE_NAME)
+        if not os.path.exists(self.baseline_file):
+            self.baseline_file = None
+        self.event_id = session_color_codes(folder)  # condition --> event code, from session_config.json
+        self.cache = cache if cache is not None else StageCache()
+        self._loaded = {}
+
+    def _stage(self, key, compute):
+        if key not in self._loaded:
+            self._loaded[key] = self.cache.get_or_compute(key, compute)
+        return self._loaded[key]
+
+    @property
+    def raw_key(self):
+        return stage_key('filtered_raw', {
+            'recording': file_hash(self.recording_file), 'ch_names': CH_NAMES,
+            'notch': NOTCH_FREQS, 'l_freq': L_FREQ, 'h_freq': H_FREQ,
+        })
+
+    @property
+    def all_epochs_key(self):
+        return stage_key('epochs', {
+            'raw': self.raw_key, 'stim_log': file_hash(self.stim_log_file),
+            'lsl': file_hash(self.lsl_file) if self.lsl_file else None,
+            'event_id': self.event_id, 'tmin': TMIN, 'tmax': TMAX,
+        })
+
+    @property
+    def artifacts_key(self):
+        return stage_key('artifacts', dict(ARTIFACT_PARAMS, epochs=self.all_epochs_key))
+
+    @property
+    def epochs_key(self):
+        return stage_key('clean_epochs', {'artifacts': self.artifacts_key})
+
+    @property
+    def psd_key(self):
+        return stage_key('psd', dict(WELCH_PARAMS, epochs=self.epochs_key))
+
+    @property
+    def baseline_key(self):
+        return stage_key('baseline', dict(WELCH_PARAMS, **{
+            'recording': file_hash(self.baseline_file), 'ch_names': CH_NAMES,
+            'notch': NOTCH_FREQS, 'l_freq': L_FREQ, 'h_freq': H_FREQ, 'bands': BANDS,
+        }))
+
+    @property
+    def tfr_key(self):
+        return stage_key('tfr', {
+            'epochs': self.epochs_key, 'freqs': TFR_FREQS.tolist(), 'n_cycles': TFR_N_CYCLES.tolist(),
+        })
+
+    def clock(self):
+        """Drift-corrected sample clock of the recording, see sync.py."""
+        if 'clock' not in self._loaded:
+            _, timestamps, _ = load_recording(self.recording_file)
+            self._loaded['clock'] = ClockSync(timestamps, load_package_num(self.recording_file))
+        return self._loaded['clock']
+
+    def events(self):
+        """Events from the LSL markers when the session has them, else from the stimulus log times."""
+        stim_log = pd.read_csv(self.stim_log_file)
+        if self.lsl_file:
+            return marker_events(read_lsl_recording(self.lsl_file), stim_log, self.clock(), self.event_id)
+        return build_events(stim_log, self.clock().corrected, self.event_id)
+
+    def filtered_raw(self):
+        return self._stage(self.raw_key, lambda: preprocess(load_raw(self.recording_file)[0]))
+
+    def all_epochs(self):
+        """Every epoch, artifacts included."""
+        return self._stage(self.all_epochs_key,
+                           lambda: make_epochs(self.filtered_raw(), self.events(), self.event_id).load_data())
+
+    def artifacts(self):
+        """Bad channels, dropped epochs and their annotations, see artifacts.py."""
+        return self._stage(self.artifacts_key, lambda: detect_artifacts(self.all_epochs(), **ARTIFACT_PARAMS))
+
+    def epochs(self):
+        """Epochs without artifacts, bad channels interpolated: what the PSD and TFR are computed on."""
+        return self._stage(self.epochs_key, lambda: apply_artifacts(self.all_epochs(), self.artifacts()))
+
+    def psd(self):
+        """Welch PSD of all epochs, index it by condition (psd['yellow']) to split."""
+        return self._stage(self.psd_key, lambda: self.epochs().compute_psd(**WELCH_PARAMS))
+
+    def baseline(self):
+        """Resting PSD and band power mean/SD per channel from the baseline recording, see baseline.py."""
+        if self.baseline_file is None:
+            raise FileNotFoundError(f'No {BASELINE_NAME} recording in {self.folder}')
+        return self._stage(self.baseline_key, lambda: resting_stats(
+            preprocess(load_raw(self.baseline_file)[0]), WELCH_PARAMS))
+
+    def tfr_bands(self, bands=TFR_BANDS):
+        """Tidy per-epoch Morlet band power over TFR_TMIN-TFR_TMAX, without the full TFR array."""
+        key = stage_key('tfr_bands', {
+            'epochs': self.epochs_key, 'bands': bands, 'tmin': TFR_TMIN, 'tmax': TFR_TMAX,
+            'n_cycles_per_hz': 0.5,
+        })
+
+        def compute():
+            epochs = self.epochs()
+            power, _ = morlet_band_power(epochs, bands, TFR_TMIN, TFR_TMAX, n_cycles_per_hz=0.5)
+            codes = {code: name for name, code in epochs.event_id.items()}
+            return tidy_table(power, [codes[c] for c in epochs.events[:, 2]], epochs.ch_names, bands)
+        return self._stage(key, compute)
+
+    def tfr(self):
+        """Full Morlet power of all epochs, index it by condition (tfr['blue']) to split."""
+        return self._stage(self.tfr_key, lambda: self.epochs().compute_tfr(
+            method='morlet', freqs=TFR_FREQS, n_cycles=TFR_N_CYCLES, return_itc=False))
+
+
+def band_table(session, bands=BANDS):
+    """Tidy (epoch, condition, channel, band) power from the Welch PSD, plus Morlet beta rows.
+
+    With a baseline recording, Welch rows also get power_db and power_zscore against the
+    resting statistics (Morlet power has another scale than the Welch PSD, its rows stay NaN).
+    """
+    welch = band_power_table(session.psd(), bands)
+    if session.baseline_file is not None:
+        resting = session.baseline()
+        for method in NORMALIZATIONS:
+            welch[f'power_{method}'] = normalize_table(welch, resting, method)
+    welch.insert(0, 'method', 'welch')
+    tfr_rows = session.tfr_bands().copy()
+    tfr_rows.insert(0, 'method', 'tfr')
+    return pd.concat([welch, tfr_rows], ignore_index=True)
+
+
+def extract_features(folder, cache=None):
+    """Computes per-epoch band power for one participant and saves it as features.csv."""
+    features = band_table(Session(folder, cache))
+    features_file = os.path.join(folder, FEATURES_FILE)
+    features.to_csv(features_file, index=False)
+    return features_file
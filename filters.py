@@ -0,0 +1,154 @@
+# Imports
+import os
+import sys
+
+import numpy as np
+from scipy import signal
+
+from recording import EXTENSION, RecordingWriter, open_recording
+
+# Causal filters with state, for data that arrives (or is read) in chunks.
+#
+# A FilterChain runs its stages one after the other along the last axis and keeps every
+# stage's delay line between calls, so feeding a signal in chunks of any size gives the same
+# output as filtering the whole array at once. The same chain serves the online monitor
+# (chunks as the board delivers them) and offline preprocessing of files of any length.
+#
+#   chain = default_chain(250.)
+#   for chunk in chunks:
+#       out = chain.process(chunk)   # (n_channels, n_samples) in, same shape out
+
+NOTCH_FREQS = [60, 120] # US powerline
+L_FREQ, H_FREQ = 1., 45.
+IIR_ORDER = 4
+NOTCH_Q = 30.
+CHUNK_SIZE = 25000  # samples per read when filtering a file
+
+
+class SOSStage:
+    """IIR stage in second-order sections."""
+
+    def __init__(self, sos):
+        self.sos = np.atleast_2d(sos)
+
+    def initial_state(self, x0):
+        """State of a filter that has seen x0 (shape (..., 1)) forever."""
+        zi = signal.sosfilt_zi(self.sos)
+        return zi.reshape((len(self.sos),) + (1,) * (x0.ndim - 1) + (2,)) * x0[None]
+
+    def dc_gain(self):
+        return np.prod(self.sos[:, :3].sum(axis=1) / self.sos[:, 3:].sum(axis=1))
+
+    def process(self, x, zi):
+        return signal.sosfilt(self.sos, x, axis=-1, zi=zi)
+
+
+class FIRStage:
+    """FIR stage, taps applied with lfilter so its delay line can be carried over."""
+
+    def __init__(self, taps):
+        self.taps = np.asarray(taps, dtype=float)
+
+    def initial_state(self, x0):
+        return signal.lfilter_zi(self.taps, 1.) * x0
+
+    def dc_gain(self):
+        return self.taps.sum()
+
+    def process(self, x, zi):
+        return signal.lfilter(self.taps, 1., x, axis=-1, zi=zi)
+
+
+def highpass(freq, sfreq, order=IIR_ORDER):
+    return SOSStage(signal.butter(order, freq, 'highpass', fs=sfreq, output='sos'))
+
+
+def lowpass(freq, sfreq, order=IIR_ORDER):
+    return SOSStage(signal.butter(order, freq, 'lowpass', fs=sfreq, output='sos'))
+
+
+def bandpass(l_freq, h_freq, sfreq, order=IIR_ORDER):
+    return SOSStage(signal.butter(order, [l_freq, h_freq], 'bandpass', fs=sfreq, output='sos'))
+
+
+def notch(freq, sfreq, q=NOTCH_Q):
+    return SOSStage(signal.tf2sos(*signal.iirnotch(freq, q, fs=sfreq)))
+
+
+def fir_bandpass(l_freq, h_freq, sfreq, numtaps=None):
+    """Linear-phase FIR band-pass (delay (numtaps - 1) / 2 samples), 3.3 / l_freq s long by default."""
+    if numtaps is None:
+        numtaps = int(3.3 * sfreq / l_freq) | 1  # odd, Hamming window transition ~ l_freq
+    return FIRStage(signal.firwin(numtaps, [l_freq, h_freq], pass_zero=False, fs=sfreq))
+
+
+class FilterChain:
+    """Stages applied in order, with their state kept from one process() call to the next.
+
+    With steady_state (the default) the state is initialised from the first sample as if
+    the signal had always sat at that value, so a large electrode offset doesn't ring
+    through the high-pass at the start. Otherwise the filters start from rest (zeros), like
+    scipy's sosfilt/lfilter without zi.
+    """
+
+    def __init__(self, stages, steady_state=True):
+        self.stages = list(stages)
+        self.steady_state = steady_state
+        self.state = None
+
+    def reset(self):
+        self.state = None
+
+    def _initial_state(self, x):
+        x0 = x[..., :1] if self.steady_state else np.zeros_like(x[..., :1])
+        state = []
+        for stage in self.stages:
+            state.append(stage.initial_state(x0))
+            x0 = x0 * stage.dc_gain()  # what the next stage sees in steady state
+        return state
+
+    def process(self, x):
+        """Filters a (..., n_samples) chunk that continues the previous one."""
+        x = np.asarray(x, dtype=float)
+        if x.shape[-1] == 0:
+            return x
+        if self.state is None:
+            self.state = self._initial_state(x)
+        for i, stage in enumerate(self.stages):
+            x, self.state[i] = stage.process(x, self.state[i])
+        return x
+
+
+def default_chain(sfreq, notch_freqs=NOTCH_FREQS, l_freq=L_FREQ, h_freq=H_FREQ):
+    """Causal counterpart of features.preprocess: powerline notches, then the band-pass."""
+    return FilterChain([notch(freq, sfreq) for freq in notch_freqs if freq < sfreq / 2]
+                       + [bandpass(l_freq, h_freq, sfreq)])
+
+
+def filter_recording(path, out_path=None, chain=None, chunk_size=CHUNK_SIZE):
+    """Writes a copy of an .eegrec recording with its EEG rows filtered, chunk by chunk.
+
+    Only one chunk of the recording is in memory at a time; the other rows (timestamps,
+    package counter, ...) are copied unchanged.
+    """
+    if out_path is None:
+        out_path = os.path.splitext(path)[0] + '_filtered' + EXTENSION
+    recording = open_recording(path)
+    if chain is None:
+        chain = default_chain(recording.sampling_rate)
+    eeg_rows = recording.board['eeg_channels']
+    all_rows = range(recording.header['n_rows'])
+    writer = RecordingWriter(out_path, recording.board_id, recording.header['dtype'],
+                             recording.header['compression'])
+    for start in range(0, recording.n_samples, chunk_size):
+        data = np.array(recording.rows(all_rows, start, start + chunk_size), dtype=float)
+        data[eeg_rows] = chain.process(data[eeg_rows])
+        writer.append(data)
+    writer.close()
+    return out_path
+
+
+if __name__ == '__main__':
+    # python filters.py results/5/eeg_data.eegrec  ->  results/5/eeg_data_filtered.eegrec
+    for file_path in sys.argv[1:]:
+        print(f'Filtered recording saved to: {filter_recording(file_path)}')
@@ -0,0 +1,344 @@
+# Imports
+import argparse
+import hashlib
+import json
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from bandpower import BANDS, band_power
+from baseline import normalize, pick_channels
+from batch import discover_participants
+from features import Session
+from loader import find_recording
+
+# Group analysis across participants, updated incrementally:
+#   python group.py                       # add every results/<id>/ not yet in the group
+#   python group.py 40                    # add participant 40 only
+#   python group.py --rebuild             # recompute the group from the summary files
+#
+# Every participant is reduced once to a compact summary (results/<id>/group_summary.npz):
+# epoch-averaged band power per condition and channel, raw and in dB of the participant's
+# resting baseline (see baseline.py; NaN without a baseline recording), and the evoked
+# response per condition. NaN values are left out of the running statistics, so a participant
+# without a baseline, or with channels dropped by artifact rejection, still counts for the rest.
+# The group keeps a running count, mean and sum of squared deviations (Welford) of every
+# summary value, plus of the first-minus-second condition difference, in group/. Adding a
+# participant reads that participant's data only; the others are already in the running sums.
+# A participant whose summary changed is taken out of the running sums with its previous
+# summary and added back with the new one. Summaries and the group state carry SUMMARY_VERSION: files
+# written by an older version are rebuilt, and an older state is recomputed from them.
+
+SUMMARY_FILE = 'group_summary.npz'
+GROUP_DIR = 'group'
+STATE_FILE = 'group_state.npz'
+MANIFEST_FILE = 'group_state.json'
+BAND_TABLE_FILE = 'group_band_power.csv'
+EVOKED_FILE = 'group_evoked.npz'
+QUANTITIES = ['band_power', 'band_power_db', 'evoked']
+SUMMARY_VERSION = 2  # bump when summarize() changes; older summaries and group states are rebuilt
+
+
+#### Per-participant summaries ####
+
+def summary_source(session):
+    """Stage keys of what a summary is built from: the clean epochs and the resting baseline."""
+    baseline_key = session.baseline_key if session.baseline_file is not None else 'no baseline'
+    return f'{session.epochs_key} {baseline_key}'
+
+
+def summarize(session, bands=BANDS):
+    """Epoch-averaged band power (condition, channel, band), raw and in dB of the resting
+    baseline (NaN when the session has no baseline recording), and evoked (condition, channel, time).
+
+    Channels are those of the recording; the ones artifact rejection dropped are NaN.
+    Conditions are the session's, in config order; the group difference is the first minus the second.
+    """
+    conditions = list(session.event_id)
+    epochs = session.epochs()
+    ch_names = session.artifacts()['ch_names']
+    rows = [ch_names.index(ch) for ch in epochs.ch_names]
+
+    def all_channels(x):
+        full = np.full((len(conditions), len(ch_names)) + x.shape[2:], np.nan)
+        full[:, rows] = x
+        return full
+
+    missing = [c for c in conditions if c not in epochs.event_id or not len(epochs[c])]
+    if missing:
+        raise ValueError(f'{session.folder}: no epochs for {missing}, a group summary needs every condition')
+    spectrum = session.psd()
+    power = [band_power(spectrum[c].get_data(), spectrum.freqs, bands) for c in conditions]
+    band_power_db = np.full((len(conditions), len(epochs.ch_names), len(bands)), np.nan)
+    if session.baseline_file is not None:
+        resting = pick_channels(session.baseline(), epochs.ch_names)
+        band_power_db = np.stack([normalize(p, resting, 'db').mean(axis=0) for p in power])
+    return {
+        'ch_names': np.array(ch_names),
+        'bands': np.array(list(bands)),
+        'conditions': np.array(conditions),
+        'times': epochs.times,
+        'n_epochs': np.array([len(epochs[c]) for c in conditions]),
+        'band_power': all_channels(np.stack([p.mean(axis=0) for p in power])),
+        'band_power_db': all_channels(band_power_db),
+        'evoked': all_channels(np.stack([epochs[c].average().data for c in conditions])),
+        'version': np.array(SUMMARY_VERSION),
+        'source': np.array(summary_source(session)),
+    }
+
+
+def summarize_participant(folder, cache=None, refresh=False):
+    """Writes folder/group_summary.npz unless an up-to-date one exists, returns its path.
+
+    A summary from another SUMMARY_VERSION is always rebuilt. With refresh, so is one whose
+    epochs or baseline are no longer those of the recordings and stimulus log (this hashes the
+    recordings, but loads nothing when unchanged).
+    """
+    path = os.path.join(folder, SUMMARY_FILE)
+    session = Session(folder, cache)
+    if os.path.exists(path):
+        with np.load(path) as summary:
+            current = 'version' in summary.files and int(summary['version']) == SUMMARY_VERSION
+            if current and (not refresh or str(summary['source']) == summary_source(session)):
+                return path
+    summary = summarize(session)
+    np.savez(path, **summary)
+    return path
+
+
+def load_summary(path):
+    with np.load(path) as summary:
+        return {name: summary[name] for name in summary.files}
+
+
+def _digest(path):
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+#### Running statistics ####
+
+class RunningStats:
+    """Per-element count, mean and sum of squared deviations of equally shaped arrays, one array at a time.
+
+    NaN elements of an added array are skipped, so counts can differ between elements.
+    """
+
+    def __init__(self, shape, n=None, mean=None, m2=None):
+        self.mean = np.zeros(shape) if mean is None else mean
+        self.n = np.zeros(self.mean.shape, dtype=int) if n is None else n
+        self.m2 = np.zeros(self.mean.shape) if m2 is None else m2
+
+    def add(self, x):
+        valid = ~np.isnan(x)
+        x = np.where(valid, x, self.mean)  # skipped elements: no change
+        self.n = self.n + valid
+        delta = x - self.mean
+        self.mean = self.mean + delta / np.maximum(self.n, 1)
+        self.m2 = self.m2 + delta * (x - self.mean)
+
+    def remove(self, x):
+        """Undoes add(x)."""
+        valid = ~np.isnan(x)
+        x = np.where(valid, x, self.mean)
+        n = self.n - valid
+        mean = np.where(n > 0, (self.n * self.mean - valid * x) / np.maximum(n, 1), 0.)
+        self.m2 = np.where(n > 1, np.maximum(self.m2 - (x - mean) * (x - self.mean), 0.), 0.)
+        self.mean, self.n = mean, n
+
+    @property
+    def std(self):
+        """Sample SD, NaN where fewer than two arrays had a value."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.n > 1, np.sqrt(self.m2 / (self.n - 1)), np.nan)
+
+    def t_test(self, popmean=0.):
+        """One-sample t and two-sided p against popmean, as scipy.stats.ttest_1samp."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (self.mean - popmean) / (self.std / np.sqrt(self.n))
+        return t, 2 * stats.t.sf(np.abs(t), self.n - 1)
+
+
+class GroupState:
+    """Running statistics of every summary quantity, and of its condition difference, per participant added."""
+
+    def __init__(self, meta=None):
+        self.meta = meta  # ch_names, bands, conditions, times of the first summary
+        self.participants = {}  # participant id -> sha256 of the summary that was added
+        self.stats = {}
+
+    def _check(self, summary):
+        meta = {name: summary[name].tolist() for name in ('ch_names', 'bands', 'conditions')}
+        meta['n_times'] = len(summary['times'])
+        if self.meta is None:
+            self.meta = dict(meta, times=summary['times'].tolist())
+            for quantity in QUANTITIES:
+                shape = summary[quantity].shape
+                self.stats[quantity] = RunningStats(shape)
+                self.stats[quantity + '_diff'] = RunningStats(shape[1:])
+        elif any(self.meta[name] != value for name, value in meta.items()):
+            raise ValueError('Summary does not match the group (channels, bands, conditions or epoch length)')
+
+    def add(self, participant, summary, digest=None):
+        self._check(summary)
+        for quantity in QUANTITIES:
+            self.stats[quantity].add(summary[quantity])
+            self.stats[quantity + '_diff'].add(summary[quantity][0] - summary[quantity][1])
+        self.participants[str(participant)] = digest
+
+    def remove(self, participant, summary):
+        for quantity in QUANTITIES:
+            self.stats[quantity].remove(summary[quantity])
+            self.stats[quantity + '_diff'].remove(summary[quantity][0] - summary[quantity][1])
+        del self.participants[str(participant)]
+
+    @property
+    def n(self):
+        return len(self.participants)
+
+    def save(self, group_dir=GROUP_DIR):
+        os.makedirs(group_dir, exist_ok=True)
+        arrays = {}
+        for name, running in self.stats.items():
+            arrays[f'{name}_n'], arrays[f'{name}_mean'], arrays[f'{name}_m2'] = running.n, running.mean, running.m2
+        np.savez(os.path.join(group_dir, STATE_FILE), **arrays)
+        with open(os.path.join(group_dir, MANIFEST_FILE), 'w') as file:
+            json.dump({'version': SUMMARY_VERSION, 'meta': self.meta, 'participants': self.participants}, file,
+                      indent=2)
+
+    @classmethod
+    def load(cls, group_dir=GROUP_DIR):
+        """The saved state, or an empty one when group_dir has none or it is from another SUMMARY_VERSION."""
+        manifest_path = os.path.join(group_dir, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return cls()
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+        if manifest.get('version') != SUMMARY_VERSION:
+            print(f'{manifest_path} is from an older summary version, recomputing the group')
+            return cls()
+        state = cls(manifest['meta'])
+        state.participants = manifest['participants']
+        if state.meta is not None:
+            with np.load(os.path.join(group_dir, STATE_FILE)) as arrays:
+                for name in [q + suffix for q in QUANTITIES for suffix in ('', '_diff')]:
+                    state.stats[name] = RunningStats(None, arrays[f'{name}_n'], arrays[f'{name}_mean'],
+                                                     arrays[f'{name}_m2'])
+        return state
+
+    def band_table(self):
+        """Per channel and band: each condition's group mean and SD, and the paired t-test of the
+        difference, raw and in dB of the resting baseline."""
+        power, diff = self.stats['band_power'], self.stats['band_power_diff']
+        t, p = diff.t_test()
+        diff_db = self.stats['band_power_db_diff']
+        t_db, p_db = diff_db.t_test()
+        first, second = self.meta['conditions'][:2]
+        ch_names, bands = self.meta['ch_names'], self.meta['bands']
+        return pd.DataFrame({
+            'channel': np.repeat(ch_names, len(bands)),
+            'band': np.tile(bands, len(ch_names)),
+            'n': diff.n.ravel(),  # participants with the channel after artifact rejection
+            f'mean_{first}': power.mean[0].ravel(), f'sd_{first}': power.std[0].ravel(),
+            f'mean_{second}': power.mean[1].ravel(), f'sd_{second}': power.std[1].ravel(),
+            'mean_diff': diff.mean.ravel(), 'sd_diff': diff.std.ravel(),
+            't': t.ravel(), 'p': p.ravel(),
+            'n_db': diff_db.n.ravel(),  # participants with a baseline recording
+            'mean_diff_db': np.where(diff_db.n > 0, diff_db.mean, np.nan).ravel(), 'sd_diff_db': diff_db.std.ravel(),
+            't_db': t_db.ravel(), 'p_db': p_db.ravel(),
+        })
+
+    def save_results(self, group_dir=GROUP_DIR):
+        """Writes the band power table (csv) and the group evoked responses with their t map (npz)."""
+        os.makedirs(group_dir, exist_ok=True)
+        self.band_table().to_csv(os.path.join(group_dir, BAND_TABLE_FILE), index=False)
+        evoked, diff = self.stats['evoked'], self.stats['evoked_diff']
+        t, p = diff.t_test()
+        np.savez(os.path.join(group_dir, EVOKED_FILE), n=self.n, times=np.array(self.meta['times']),
+                 ch_names=np.array(self.meta['ch_names']), conditions=np.array(self.meta['conditions']),
+                 mean=evoked.mean, std=evoked.std, diff_mean=diff.mean, diff_std=diff.std, t=t, p=p)
+
+
+#### Group update ####
+
+def _summarize(folder):
+    return summarize_participant(folder)
+
+
+def _summarize_refresh(folder):
+    return summarize_participant(folder, refresh=True)
+
+
+def update_group(root_folder='results', participants=None, group_dir=GROUP_DIR, rebuild=False,
+                 refresh=False, max_workers=None):
+    """Adds the participants that are not in the group yet, saves the state and the group results.
+
+    Only participants missing from the group have a summary built (one process each) and read.
+    refresh also checks every participant's summary against its recordings; a participant whose
+    summary changed is removed from the group with its previous summary and added with the new
+    one. rebuild recomputes the group from the summary files.
+    """
+    if participants is None:
+        participants = discover_participants(root_folder)
+    state = GroupState() if rebuild else GroupState.load(group_dir)
+    folders = {str(p): os.path.join(root_folder, str(p)) for p in participants}
+    folders = {p: folder for p, folder in folders.items() if os.path.exists(find_recording(folder))}
+    todo = folders if refresh or rebuild else {p: f for p, f in folders.items() if p not in state.participants}
+    # The summaries in the group as they were added, to take them out again if they change
+    previous = {}
+    for participant in state.participants.keys() & todo.keys():
+        path = os.path.join(todo[participant], SUMMARY_FILE)
+        if os.path.exists(path) and _digest(path) == state.participants[participant]:
+            previous[participant] = load_summary(path)
+
+    summaries, failed = {}, {}
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(_summarize_refresh if refresh else _summarize, folder): p for p, folder in todo.items()}
+        for future in as_completed(futures):
+            participant = futures[future]
+            try:
+                summaries[participant] = future.result()
+            except Exception:
+                failed[participant] = traceback.format_exc()
+                print(f'{participant}: FAILED\n{traceback.format_exc(limit=1)}')
+
+    digests = {p: _digest(path) for p, path in summaries.items()}
+    for participant in sorted(digests):
+        if state.participants.get(participant) == digests[participant]:
+            continue
+        if participant in state.participants:
+            if participant not in previous:
+                raise RuntimeError(f'{participant}: the summary in the group is gone, run with --rebuild')
+            state.remove(participant, previous[participant])
+        state.add(participant, load_summary(summaries[participant]), digests[participant])
+        print(f'{participant}: {"updated" if participant in previous else "added"}')
+
+    if state.meta is None:
+        print('No participant could be summarized, nothing to save')
+        return state
+    state.save(group_dir)
+    state.save_results(group_dir)
+    print(f'Group of {state.n} participant(s) saved to {group_dir}/')
+    return state
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Adds participants to the incremental group analysis')
+    parser.add_argument('participants', nargs='*', help='participant ids (default: every folder in root)')
+    parser.add_argument('--root', default='results')
+    parser.add_argument('--group-dir', default=GROUP_DIR)
+    parser.add_argument('--rebuild', action='store_true', help='recompute the group from all summary files')
+    parser.add_argument('--refresh', action='store_true',
+                        help='rebuild summaries whose recording or stimulus log changed')
+    parser.add_argument('--workers', type=int, default=None, help='summary processes (default: CPU count)')
+    args = parser.parse_args()
+
+    state = update_group(args.root, args.participants or None, args.group_dir, args.rebuild, args.refresh,
+                         args.workers)
+    if state.n > 1:
+        table = state.band_table().sort_values('p')
+        print(table.head(10).to_string(index=False))
@@ -0,0 +1,125 @@
+# Imports
+import os
+
+import mne
+import numpy as np
+import pandas as pd
+from brainflow.board_shim import BoardShim
+
+from recording import EXTENSION, open_recording
+
+# Electrode positions used in the experiment (10-20 system), in board channel order
+CH_NAMES = ['Fp1', 'Fp2', 'O1', 'O2', 'T5', 'T6', 'P3', 'P4']
+SFREQ = 250.  # Cyton sampling rate, used for cleaned CSVs which don't store it
+CSV_CHUNK_SIZE = 50000  # rows parsed at a time when caching a cleaned CSV
+
+
+def _count_rows(csv_path):
+    with open(csv_path, 'rb') as file:
+        n_lines = sum(buf.count(b'\n') for buf in iter(lambda: file.read(1 << 20), b''))
+    return n_lines - 1  # header
+
+
+def csv_cache_path(csv_path):
+    return os.path.splitext(csv_path)[0] + '.npy'
+
+
+def cache_cleaned_csv(csv_path):
+    """Parses a cleaned CSV once into a channel-major .npy next to it (row 0 = Timestamp).
+
+    The CSV is read in chunks straight into the memory-mapped .npy, so this never holds
+    more than one chunk in memory. The cache is rebuilt when the CSV is newer.
+    """
+    npy_path = csv_cache_path(csv_path)
+    if os.path.exists(npy_path) and os.path.getmtime(npy_path) >= os.path.getmtime(csv_path):
+        return npy_path
+
+    n_samples = _count_rows(csv_path)
+    columns = pd.read_csv(csv_path, nrows=0).columns
+    tmp_path = npy_path + '.tmp.npy'
+    out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float64,
+                                    shape=(len(columns), n_samples))
+    start = 0
+    for chunk in pd.read_csv(csv_path, chunksize=CSV_CHUNK_SIZE, dtype=np.float64):
+        out[:, start:start + len(chunk)] = chunk.to_numpy().T
+        start += len(chunk)
+    out.flush()
+    del out
+    os.replace(tmp_path, npy_path)  # never leave a half-written cache behind
+    return npy_path
+
+
+def load_recording(path, mode='r'):
+    """Returns (data, timestamps, sfreq) with data a memory-mapped (n_channels, n_samples) array.
+
+    path is either an .eegrec recording (EEG rows picked with its channel map) or a cleaned
+    CSV (Timestamp + one column per channel), which gets cached as .npy on first use.
+    Use mode='c' for copy-on-write when the data will be modified in place (filtering).
+    """
+    if path.endswith(EXTENSION):
+        recording = open_recording(path, mode)
+        return recording.eeg, recording.timestamps, float(recording.sampling_rate)
+    cached = np.load(cache_cleaned_csv(path), mmap_mode=mode)
+    return cached[1:], cached[0], SFREQ
+
+
+def load_package_num(path, board_id=0):
+    """Package counter of a recording, or None if it wasn't kept.
+
+    .eegrec files store every board row. Cleaned CSVs drop the counter, so it is read from
+    the raw CSV next to them when that is still around (column k of the raw CSV is BrainFlow
+    row k, board_id says which row holds the counter).
+    """
+    if path.endswith(EXTENSION):
+        recording = open_recording(path)
+        return recording.row(recording.board['package_num_channel'])
+    raw_csv = path.replace('_cleaned.csv', '.csv')
+    if raw_csv == path or not os.path.exists(raw_csv):
+        return None
+    column = BoardShim.get_board_descr(board_id)['package_num_channel']
+    return pd.read_csv(raw_csv, usecols=[column]).iloc[:, 0].to_numpy()
+
+
+def find_recording(folder, name='eeg_data'):
+    """Picks '<name>.eegrec' in a results folder, falling back to '<name>_cleaned.csv'."""
+    native = os.path.join(folder, name + EXTENSION)
+    if os.path.exists(native):
+        return native
+    return os.path.join(folder, name + '_cleaned.csv')
+
+
+def recording_ch_names(path, n_channels):
+    """Names of a recording's n_channels EEG rows.
+
+    CH_NAMES when the count matches the experiment's montage, else the names of the board
+    that made the recording, from the .eegrec header (e.g. the 16-channel synthetic board a
+    session falls back to without the dongle).
+    """
+    if n_channels == len(CH_NAMES):
+        return CH_NAMES
+    if path.endswith(EXTENSION):
+        names = open_recording(path).board.get('eeg_names', '').split(',')
+        if len(names) == n_channels:
+            return names
+    raise ValueError(f'{path} has {n_channels} EEG channels, the montage has {len(CH_NAMES)} '
+                     f'({", ".join(CH_NAMES)}) and the recording names none')
+
+
+def load_raw(path, ch_names=None, montage='standard_1020'):
+    """Builds an mne RawArray on top of the memory map, returns (raw, timestamps).
+
+    The Raw object wraps the copy-on-write map directly: nothing is transposed or copied
+    when it is created, pages are only duplicated once filtering writes to them. float32
+    recordings are the exception, MNE needs float64 and converts them. ch_names defaults to
+    recording_ch_names.
+    """
+    data, timestamps, sfreq = load_recording(path, mode='c')
+    if ch_names is None:
+        ch_names = recording_ch_names(path, len(data))
+    elif len(ch_names) != len(data):
+        raise ValueError(f'{path} has {len(data)} EEG channels, {len(ch_names)} names given')
+    info = mne.create_info(ch_names=list(ch_names), sfreq=sfreq, ch_types='eeg')
+    raw = mne.io.RawArray(data, info, copy=None if data.dtype == np.float64 else 'auto')
+    if montage is not None:
+        raw.set_montage(mne.channels.make_standard_montage(montage))
+    return raw, timestamps
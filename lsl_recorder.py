@@ -0,0 +1,185 @@
+# Imports
+import json
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from brainflow.board_shim import BoardShim
+from pylsl import StreamInfo, StreamInlet, StreamOutlet, local_clock, proc_clocksync, resolve_byprop
+
+from events import COLOR_CODES, coded_trials, condition_codes, nearest_samples
+
+# EEG and markers co-recorded on the LSL clock.
+#
+# BoardLSLPublisher republishes the board's EEG as an LSL stream (it plugs into
+# StreamRecorder as a listener, so the ring buffer is still drained only once), and
+# LSLRecorder subscribes to that stream and to the experiment's marker stream. LSL measures
+# the clock offset of every outlet (time_correction) and the inlets apply it, so both streams
+# arrive stamped on the recorder's local_clock() and are written to one SQLite file:
+#   streams(name, type, ...)                      one row per stream
+#   chunks(stream, timestamps BLOB, data BLOB)    float64 samples, in arrival order
+#   offsets(stream, local_time, offset)           measured clock corrections, for the record
+#
+# The EEG stream carries each sample's BrainFlow timestamp as its last channel, so the
+# recording holds the offset between the LSL clock and the host clock the .eegrec files are
+# stamped with. A marker is taken back to the host clock with that offset and placed with the
+# recording's fitted sample clock (sync.ClockSync), like the stimulus log onsets are.
+#
+# Streams are resolved by source_id, so other EEG outlets on the network can't be picked up.
+
+EEG_STREAM_NAME = 'OpenBCI_EEG'
+MARKER_SOURCE_ID = 'marker_stream'  # the experiment's marker outlet
+HOST_TIME_LABEL = 'brainflow_time'
+RESOLVE_TIMEOUT = 5.0
+POLL_INTERVAL = 0.05
+OFFSET_INTERVAL = 5.0  # seconds between logged time_correction() measurements
+
+
+class BoardLSLPublisher:
+    """Pushes BrainFlow chunks of EEG rows plus their BrainFlow timestamp to an LSL outlet, stamped on the LSL clock."""
+
+    def __init__(self, board_id, name=EEG_STREAM_NAME, ch_names=None):
+        board = BoardShim.get_board_descr(board_id)
+        self.eeg_rows = board['eeg_channels']
+        self.timestamp_row = board['timestamp_channel']
+        if ch_names is None:
+            ch_names = board.get('eeg_names', '').split(',')
+        self.source_id = f'{name}_{board_id}'
+        # double64: float32 can't hold an epoch timestamp to the sample
+        info = StreamInfo(name, 'EEG', len(self.eeg_rows) + 1, board['sampling_rate'], 'double64', self.source_id)
+        channels = info.desc().append_child('channels')
+        for ch in ch_names[:len(self.eeg_rows)]:
+            channels.append_child('channel').append_child_value('label', ch).append_child_value('unit', 'microvolts')
+        channels.append_child('channel').append_child_value('label', HOST_TIME_LABEL).append_child_value('unit', 's')
+        self.outlet = StreamOutlet(info)
+
+    def push(self, data):
+        """StreamRecorder listener: data is a (n_rows, n_samples) BrainFlow chunk."""
+        # BrainFlow stamps with time.time(); shift to local_clock(), measured now so NTP slews can't pile up
+        offset = local_clock() - time.time()
+        timestamps = data[self.timestamp_row] + offset
+        samples = np.vstack([data[self.eeg_rows], data[self.timestamp_row]])
+        self.outlet.push_chunk(np.ascontiguousarray(samples.T), timestamps.tolist())
+
+
+class LSLRecorder(threading.Thread):
+    """Records LSL streams into one SQLite file with clock-corrected timestamps.
+
+    source_ids maps the name each stream is stored under ('EEG', 'Markers') to the source_id
+    of its outlet, e.g. {'EEG': publisher.source_id, 'Markers': MARKER_SOURCE_ID}.
+    """
+
+    def __init__(self, path, source_ids, resolve_timeout=RESOLVE_TIMEOUT):
+        super().__init__(daemon=True)
+        self.path = path
+        self.inlets = {}
+        for stream_type, source_id in source_ids.items():
+            found = resolve_byprop('source_id', source_id, timeout=resolve_timeout)
+            if not found:
+                raise RuntimeError(f'No LSL stream with source_id {source_id} found')
+            if len({info.uid() for info in found}) > 1:
+                raise RuntimeError(f'{len(found)} LSL streams with source_id {source_id} found (hosts '
+                                   f'{sorted(info.hostname() for info in found)}), close the others')
+            # No proc_dejitter: it would spread the pause between the baseline and the main
+            # block over the samples after it
+            inlet = StreamInlet(found[0], processing_flags=proc_clocksync)
+            inlet.open_stream(timeout=resolve_timeout)  # buffer from now on, not from the first pull
+            self.inlets[stream_type] = inlet
+        self._stop_event = threading.Event()
+
+    def _open(self):
+        db = sqlite3.connect(self.path)
+        db.executescript('''
+            CREATE TABLE IF NOT EXISTS streams (name TEXT PRIMARY KEY, type TEXT, channel_count INTEGER,
+                                                nominal_srate REAL, channel_format INTEGER, info TEXT);
+            CREATE TABLE IF NOT EXISTS chunks (stream TEXT, timestamps BLOB, data BLOB);
+            CREATE TABLE IF NOT EXISTS offsets (stream TEXT, local_time REAL, offset REAL);
+        ''')
+        for stream_type, inlet in self.inlets.items():
+            info = inlet.info()
+            db.execute('INSERT OR REPLACE INTO streams VALUES (?, ?, ?, ?, ?, ?)',
+                       (stream_type, info.type(), info.channel_count(), info.nominal_srate(),
+                        info.channel_format(), json.dumps({'name': info.name(), 'xml': info.as_xml()})))
+        db.commit()
+        return db
+
+    def _log_offsets(self, db):
+        for stream_type, inlet in self.inlets.items():
+            db.execute('INSERT INTO offsets VALUES (?, ?, ?)',
+                       (stream_type, local_clock(), inlet.time_correction(timeout=1.0)))
+
+    def _pull(self, db):
+        n_pulled = 0
+        for stream_type, inlet in self.inlets.items():
+            samples, timestamps = inlet.pull_chunk(timeout=0.0, max_samples=4096)
+            if timestamps:
+                db.execute('INSERT INTO chunks VALUES (?, ?, ?)',
+                           (stream_type, np.asarray(timestamps, dtype=np.float64).tobytes(),
+                            np.asarray(samples, dtype=np.float64).tobytes()))
+                n_pulled += len(timestamps)
+        db.commit()  # every chunk on disk before the next poll
+        return n_pulled
+
+    def run(self):
+        db = self._open()  # sqlite connections stay in the thread that made them
+        self._log_offsets(db)
+        last_offset = time.monotonic()
+        while not self._stop_event.is_set():
+            if not self._pull(db):
+                time.sleep(POLL_INTERVAL)
+            if time.monotonic() - last_offset > OFFSET_INTERVAL:
+                self._log_offsets(db)
+                last_offset = time.monotonic()
+        while self._pull(db):  # whatever arrived before stop()
+            pass
+        self._log_offsets(db)
+        db.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def read_lsl_recording(path):
+    """Returns {stream_type: (data (n_channels, n_samples), timestamps)} from an LSLRecorder file."""
+    db = sqlite3.connect(path)
+    streams = {name: count for name, count in db.execute('SELECT name, channel_count FROM streams')}
+    recording = {}
+    for name, count in streams.items():
+        rows = db.execute('SELECT timestamps, data FROM chunks WHERE stream = ? ORDER BY rowid', (name,)).fetchall()
+        timestamps = np.concatenate([np.frombuffer(t, dtype=np.float64) for t, _ in rows]) if rows else np.empty(0)
+        data = np.concatenate([np.frombuffer(d, dtype=np.float64) for _, d in rows]) if rows else np.empty(0)
+        recording[name] = (data.reshape(-1, count).T, timestamps)
+    db.close()
+    return recording
+
+
+def marker_events(recording, stim_log, clock, color_codes=COLOR_CODES):
+    """mne events from the recorded trial markers, placed with the recording's ClockSync.
+
+    Marker values are trial numbers; the stimulus log gives each one its condition (trials
+    without an event code are left out, see coded_trials). Baseline markers (999/1000) are
+    left out. Each marker's LSL time is taken back to the host clock with the LSL - host offset
+    of the nearest EEG sample, then snapped with clock.samples like the logged onsets. The
+    offset is the one the publisher applied to that sample's chunk, the same for every sample
+    in it, so the burstiness of the raw BrainFlow stamps does not reach the events.
+    """
+    eeg, eeg_timestamps = recording['EEG']
+    offsets = eeg_timestamps - eeg[-1]  # LSL clock - host clock, per sample
+    markers, marker_timestamps = recording['Markers']
+    markers = markers[0].astype(int)
+    conditions = coded_trials(stim_log, color_codes).set_index('Marker')['Color']
+    is_trial = np.isin(markers, conditions.index)
+
+    times = marker_timestamps[is_trial]
+    host_times = times - offsets[nearest_samples(eeg_timestamps, times)]
+    outside = (host_times < clock.corrected[0]) | (host_times > clock.corrected[-1])
+    if outside.any():
+        raise ValueError(f'{outside.sum()} trial markers fall outside the recording '
+                         f'(markers {markers[is_trial][outside].tolist()})')
+
+    events = np.zeros((is_trial.sum(), 3), dtype=int)
+    events[:, 0] = clock.samples(host_times)
+    events[:, 2] = condition_codes(conditions.loc[markers[is_trial]].to_numpy(), color_codes)
+    return events
@@ -0,0 +1,157 @@
+# Imports
+import csv
+import queue
+import threading
+import time
+
+import numpy as np
+from brainflow.board_shim import BoardShim
+from scipy import signal
+
+from bandpower import band_power
+from filters import FilterChain, highpass, notch
+
+# Online signal-quality monitor, run next to the PsychoPy loop.
+#
+# It plugs into StreamRecorder as a listener, so it sees every sample exactly once without
+# touching the board's ring buffer; the listener only queues the chunk, all the work happens
+# in the monitor's own thread. New samples go through a high-pass and a notch filter whose
+# state is carried from chunk to chunk, the last WINDOW seconds are kept, and a few times a
+# second every channel gets alpha/beta power, line-noise and railing indicators.
+
+WINDOW = 2.  # seconds of signal the indicators are computed on
+UPDATE_INTERVAL = 0.25  # seconds between updates
+HIGH_PASS = 1.  # Hz, removes the electrode DC offset before the band power
+LINE_FREQ = 60.  # US powerline
+MONITOR_BANDS = {'alpha': (8, 12), 'beta': (13, 30)}
+LINE_BAND = (LINE_FREQ - 2, LINE_FREQ + 2)
+SIGNAL_BAND = (1, 45)
+
+# Channel status thresholds, raw signal in uV
+RAIL_UV = 187500.  # Cyton full scale at gain 24 (4.5 V / 24)
+RAILED_FRACTION = 0.9  # |x| above this fraction of full scale counts as railed
+OFFSET_LIMIT_UV = 5000.  # DC offset of a loose or dry electrode
+FLAT_STD_UV = 0.5  # less than this is a disconnected channel
+LINE_RATIO_LIMIT = 10.  # line band power over mean 1-45 Hz power
+
+STATUS_FIELDS = ['alpha', 'beta', 'line_ratio', 'offset', 'std', 'railed', 'status']
+
+
+def channel_status(railed, offset, std, line_ratio):
+    """Worst problem of every channel: 'railed', 'flat', 'offset', 'line' or 'ok'."""
+    status = np.full(len(railed), 'ok', dtype=object)
+    status[line_ratio > LINE_RATIO_LIMIT] = 'line'
+    status[np.abs(offset) > OFFSET_LIMIT_UV] = 'offset'
+    status[std < FLAT_STD_UV] = 'flat'
+    status[railed > 0] = 'railed'
+    return status
+
+
+class OnlineMonitor(threading.Thread):
+    """Per-channel band power and signal-quality indicators, updated while the board streams.
+
+    Usage:
+        monitor = OnlineMonitor(board_id, log_file='results/1/monitor_log.csv')
+        monitor.start()
+        recorder = StreamRecorder(board, board_id, path, listeners=[monitor.push])
+        ...
+        monitor.stop()
+
+    monitor.latest holds the last update ({field: array per channel}); channels whose status
+    changes are reported on the console, every update is appended to log_file.
+    """
+
+    def __init__(self, board_id, ch_names=None, log_file=None, window=WINDOW,
+                 update_interval=UPDATE_INTERVAL, verbose=True):
+        super().__init__(daemon=True)
+        board = BoardShim.get_board_descr(board_id)
+        self.eeg_rows = board['eeg_channels']
+        self.sfreq = board['sampling_rate']
+        self.ch_names = ch_names or [f'ch{i + 1}' for i in range(len(self.eeg_rows))]
+        self.update_interval = update_interval
+        self.verbose = verbose
+        self.latest = None
+        n_channels, n_window = len(self.eeg_rows), int(window * self.sfreq)
+
+        # Two chains so the line noise can be measured between them, both keep their state
+        # between chunks and start in steady state (a 9000 uV offset would ring for seconds)
+        self._high_pass = FilterChain([highpass(HIGH_PASS, self.sfreq)])
+        self._notch = FilterChain([notch(LINE_FREQ, self.sfreq)])
+        # Raw, high-passed and notched copies of the last window, newest sample last
+        self._buffer = np.zeros((3, n_channels, n_window))
+        self._n_buffered = 0
+        self._queue = queue.Queue()
+        self._stop_event = threading.Event()
+        self._status = ['ok'] * n_channels  # problems already present are reported on the first update
+        self._log = None
+        if log_file is not None:
+            self._log_file = open(log_file, 'w', newline='')
+            self._log = csv.writer(self._log_file)
+            self._log.writerow(['time', 'channel'] + STATUS_FIELDS)
+
+    def push(self, data):
+        """StreamRecorder listener: queues a (n_rows, n_samples) BrainFlow chunk, nothing else."""
+        self._queue.put(data[self.eeg_rows])
+
+    def _filter(self, raw):
+        high_passed = self._high_pass.process(raw)
+        return raw, high_passed, self._notch.process(high_passed)
+
+    def _append(self, chunk):
+        new = np.stack(self._filter(chunk))[..., -self._buffer.shape[-1]:]
+        n = new.shape[-1]
+        self._buffer[..., :-n] = self._buffer[..., n:]
+        self._buffer[..., -n:] = new
+        self._n_buffered = min(self._n_buffered + n, self._buffer.shape[-1])
+
+    def update(self):
+        """Computes the indicators on the buffered window, returns {field: per-channel array}."""
+        raw, high_passed, notched = self._buffer[..., -self._n_buffered:]
+        nperseg = min(self._n_buffered, int(self.sfreq))
+        freqs, psd = signal.welch(np.stack([high_passed, notched]), self.sfreq, nperseg=nperseg, axis=-1)
+        line, broadband = band_power(psd[0], freqs, {'line': LINE_BAND, 'signal': SIGNAL_BAND}).T
+        alpha, beta = band_power(psd[1], freqs, MONITOR_BANDS).T
+        offset = raw.mean(axis=1)
+        railed = (np.abs(raw) >= RAILED_FRACTION * RAIL_UV).mean(axis=1)
+        std = high_passed.std(axis=1)
+        line_ratio = line / np.maximum(broadband, np.finfo(float).tiny)
+        return {
+            'alpha': alpha, 'beta': beta, 'line_ratio': line_ratio, 'offset': offset,
+            'std': std, 'railed': railed, 'status': channel_status(railed, offset, std, line_ratio),
+        }
+
+    def _report(self, latest):
+        if self._log is not None:
+            now = time.time()
+            for i, ch in enumerate(self.ch_names):
+                self._log.writerow([now, ch] + [latest[field][i] for field in STATUS_FIELDS])
+            self._log_file.flush()
+        if self.verbose:
+            for ch, before, after, offset in zip(self.ch_names, self._status, latest['status'], latest['offset']):
+                if before != after:
+                    print(f'[monitor] {ch}: {before} -> {after} (offset {offset:.0f} uV)')
+        self._status = latest['status']
+
+    def run(self):
+        min_samples = int(self.sfreq * 0.5)  # Welch needs some signal to say anything
+        next_update = time.monotonic()
+        while not self._stop_event.is_set():
+            try:
+                chunk = self._queue.get(timeout=self.update_interval)
+            except queue.Empty:
+                continue
+            self._append(chunk)
+            while not self._queue.empty():  # catch up in one go after a stall
+                self._append(self._queue.get())
+            if self._n_buffered >= min_samples and time.monotonic() >= next_update:
+                self.latest = self.update()
+                self._report(self.latest)
+                next_update = time.monotonic() + self.update_interval
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        if self._log is not None:
+            self._log_file.close()
+            self._log = None
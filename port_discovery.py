@@ -0,0 +1,98 @@
+# Imports
+import glob
+import json
+import os
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import serial
+from serial import Serial
+from serial.tools import list_ports
+
+BAUD_RATE = 115200
+PROBE_TIMEOUT = 3.0  # seconds a port gets to answer 'v' with its '$$$'-terminated banner
+READ_TIMEOUT = 0.05  # single read call, keeps the probe loop responsive
+FTDI_VID = 0x0403  # the Cyton dongle is an FTDI FT231X
+CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'cogs189', 'openbci_port.json')
+
+
+def candidate_ports():
+    """Serial ports that exist on this machine, FTDI devices (the Cyton dongle) first."""
+    ports = list_ports.comports()
+    if ports:
+        ports = sorted(ports, key=lambda p: p.vid != FTDI_VID)
+        return [p.device for p in ports]
+    # list_ports found nothing (e.g. no udev), fall back to the usual device names
+    if sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
+        return glob.glob('/dev/ttyUSB*')
+    elif sys.platform.startswith('darwin'):
+        return glob.glob('/dev/cu.usbserial*')
+    return []
+
+
+def probe_port(port, timeout=PROBE_TIMEOUT):
+    """True if an OpenBCI board answers the 'v' (version) command on this port before timeout."""
+    try:
+        with Serial(port=port, baudrate=BAUD_RATE, timeout=READ_TIMEOUT) as s:
+            s.reset_input_buffer()
+            s.write(b'v')
+            reply = b''
+            deadline = time.monotonic() + timeout
+            while b'$$$' not in reply and time.monotonic() < deadline:
+                reply += s.read(max(1, s.in_waiting))  # whatever is buffered, in one call
+            return b'OpenBCI' in reply
+    except (OSError, serial.SerialException):
+        return False
+
+
+def _load_cache():
+    try:
+        with open(CACHE_FILE) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(port):
+    cache = _load_cache()
+    cache[socket.gethostname()] = port
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        with open(CACHE_FILE, 'w') as file:
+            json.dump(cache, file)
+    except OSError:
+        pass  # the cache is only a shortcut
+
+
+def find_openbci_port(timeout=PROBE_TIMEOUT):
+    """Finds the port to which the Cyton Dongle is connected to, or None.
+
+    The port that worked last time on this host is validated first; otherwise every
+    candidate port is probed at the same time, each with its own timeout.
+    """
+    cached = _load_cache().get(socket.gethostname())
+    ports = candidate_ports()
+    if cached in ports and probe_port(cached, timeout):
+        return cached
+
+    ports = [p for p in ports if p != cached]
+    if not ports:
+        return None
+    pool = ThreadPoolExecutor(max_workers=len(ports))
+    futures = {pool.submit(probe_port, port, timeout): port for port in ports}
+    try:
+        for future in as_completed(futures):
+            if future.result():
+                _save_cache(futures[future])
+                return futures[future]
+        return None
+    finally:
+        pool.shutdown(wait=False)  # don't wait for slow ports once the board answered
+
+
+if __name__ == '__main__':
+    start = time.monotonic()
+    port = find_openbci_port()
+    print(f'OpenBCI port: {port} ({time.monotonic() - start:.2f} s)')
@@ -0,0 +1,76 @@
+# Imports
+import threading
+import time
+
+from recording import open_writer
+
+
+class StreamRecorder(threading.Thread):
+    """Drains the BrainFlow ring buffer to disk in chunks while the board streams.
+
+    The file extension picks the format: '.eegrec' (see recording.py) or '.csv'.
+    listeners are called with every chunk after it is written, e.g. BoardLSLPublisher.push.
+
+    Usage:
+        recorder = StreamRecorder(board, board_id, 'results/1/eeg_data.eegrec')
+        board.start_stream()
+        recorder.start()
+        ...  # run the experiment
+        board.stop_stream()
+        recorder.stop()  # final drain + close, returns the number of samples written
+    """
+
+    def __init__(self, board, board_id, file_path, chunk_size=250, poll_interval=0.2,
+                 dtype='float64', compression=None, listeners=()):
+        super().__init__(daemon=True)
+        self.board = board
+        self.file_path = file_path
+        self.chunk_size = chunk_size  # samples per read, 250 = 1 s on the Cyton
+        self.poll_interval = poll_interval
+        self.samples_written = 0
+        self.write_seconds = 0.  # spent in the writer's append (flush included) and close
+        self.listeners = list(listeners)
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()  # the final drain in stop() must not race the thread
+        self._writer = open_writer(file_path, board_id, dtype, compression)
+        self._closed = False
+
+    def run(self):
+        while not self._stop_event.is_set():
+            if self.board.get_board_data_count() >= self.chunk_size:
+                self.drain(self.chunk_size)
+            else:
+                time.sleep(self.poll_interval)
+
+    def drain(self, max_samples=None):
+        """Moves up to max_samples (default: everything buffered) from the board to disk."""
+        with self._lock:
+            if self._closed:
+                return 0
+            count = self.board.get_board_data_count()
+            if max_samples is not None:
+                count = min(count, max_samples)
+            if count == 0:
+                return 0
+            data = self.board.get_board_data(count)  # removes the samples from the ring buffer
+            start = time.perf_counter()
+            self._writer.append(data)  # flushed, so it survives a crash of the experiment script
+            self.write_seconds += time.perf_counter() - start
+            self.samples_written += data.shape[1]
+            for listener in self.listeners:
+                listener(data)
+            return data.shape[1]
+
+    def stop(self):
+        """Stops the thread, writes whatever is still buffered and finalises the file."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        while self.drain():
+            pass
+        with self._lock:
+            start = time.perf_counter()
+            self._writer.close()
+            self.write_seconds += time.perf_counter() - start
+            self._closed = True
+        return self.samples_written
@@ -0,0 +1,319 @@
+# Imports
+import csv
+import json
+import os
+import struct
+import sys
+import zlib
+
+import numpy as np
+from brainflow.board_shim import BoardShim
+
+# Native EEG recording format (.eegrec)
+#
+#   magic (8 bytes) | header length (uint32, little endian) | JSON header | padding | blocks
+#
+# The JSON header holds the board id, sampling rate and the BrainFlow board description
+# (channel map). The data follows as channel blocks: every block stores a set of BrainFlow
+# rows channel-major, i.e. each channel is one contiguous run of samples, so an uncompressed
+# block can be memory-mapped as a (n_rows, n_samples) array without parsing anything.
+# Timestamps always go in a float64 block, float32 would round unix time to minutes.
+#
+# While recording, samples are appended to a '<path>.part' spool (same header, sample-major
+# float64 rows). RecordingWriter.close() turns the spool into the channel-block file, and
+# recover_recording() does the same for a spool left behind by a crashed session.
+
+MAGIC = b'EEGREC\x00\x01'
+FORMAT_VERSION = 1
+EXTENSION = '.eegrec'
+SPOOL_SUFFIX = '.part'
+ALIGNMENT = 64  # data section starts on a 64 byte boundary
+SPOOL_CHUNK = 1024  # spool samples turned channel-major at a time, small enough to stay in cache
+GATHER_BYTES = 128 * 2 ** 20  # compressed files: channels gathered per pass over the spool
+COMPRESSIONS = (None, 'zlib')
+
+
+def board_header(board_id, dtype='float64', compression=None):
+    """Builds the header fields shared by every recording made with the given board."""
+    if np.dtype(dtype) not in (np.dtype('float32'), np.dtype('float64')):
+        raise ValueError(f"Unsupported dtype {dtype}, use float32 or float64")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unsupported compression {compression}, use one of {COMPRESSIONS}")
+    board = BoardShim.get_board_descr(board_id)
+    return {
+        'format_version': FORMAT_VERSION,
+        'board_id': board_id,
+        'sampling_rate': board['sampling_rate'],
+        'n_rows': board['num_rows'],
+        'dtype': np.dtype(dtype).name,
+        'compression': compression,
+        'board': board,  # channel map: eeg_channels, timestamp_channel, eeg_names, ...
+    }
+
+
+def _block_layout(header):
+    """Splits the BrainFlow rows into dtype blocks, keeping the timestamp row in float64."""
+    rows = list(range(header['n_rows']))
+    if header['dtype'] == 'float64':
+        return [{'rows': rows, 'dtype': 'float64'}]
+    timestamp_row = header['board']['timestamp_channel']
+    return [
+        {'rows': [r for r in rows if r != timestamp_row], 'dtype': header['dtype']},
+        {'rows': [timestamp_row], 'dtype': 'float64'},
+    ]
+
+
+def _write_header(file, header):
+    payload = json.dumps(header).encode('utf-8')
+    prefix = len(MAGIC) + 4
+    padding = -(prefix + len(payload)) % ALIGNMENT
+    file.write(MAGIC)
+    file.write(struct.pack('<I', len(payload) + padding))
+    file.write(payload + b' ' * padding)  # json ignores trailing whitespace
+    return prefix + len(payload) + padding
+
+
+def read_header(path):
+    """Returns (header, data_offset) of a recording or recording spool."""
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an {EXTENSION} recording")
+        (length,) = struct.unpack('<I', file.read(4))
+        header = json.loads(file.read(length).decode('utf-8'))
+    return header, len(MAGIC) + 4 + length
+
+
+def _write_blocks(path, header, iter_block, n_samples, fill_block=None):
+    """Writes header + channel blocks; iter_block(rows, dtype) yields the block's arrays in order.
+
+    fill_block(rows, out), when given, fills an uncompressed block in place instead: out is the
+    block's (n_rows, n_samples) memory map in the file.
+    """
+    header = dict(header, n_samples=n_samples, layout='channel-blocks')
+    blocks = _block_layout(header)
+    compressed = []
+    offset = 0
+    for block in blocks:
+        if header['compression'] == 'zlib':
+            compressor = zlib.compressobj()
+            payload = b''.join(compressor.compress(a.tobytes()) for a in iter_block(block['rows'], block['dtype']))
+            payload += compressor.flush()
+            compressed.append(payload)
+            nbytes = len(payload)
+        else:
+            nbytes = len(block['rows']) * n_samples * np.dtype(block['dtype']).itemsize
+        block.update(offset=offset, nbytes=nbytes)
+        offset += nbytes
+    header['blocks'] = blocks
+
+    with open(path, 'wb') as file:
+        data_offset = _write_header(file, header)
+        if compressed:
+            for payload in compressed:
+                file.write(payload)
+        elif fill_block is not None:
+            file.truncate(data_offset + offset)
+        else:
+            for block in blocks:
+                for array in iter_block(block['rows'], block['dtype']):
+                    array.tofile(file)
+    if fill_block is not None and not compressed and n_samples:
+        for block in blocks:
+            out = np.memmap(path, dtype=block['dtype'], mode='r+', offset=data_offset + block['offset'],
+                            shape=(len(block['rows']), n_samples))
+            fill_block(block['rows'], out)
+            out.flush()
+            del out
+
+
+def write_recording(path, data, board_id, dtype='float64', compression=None):
+    """Writes a BrainFlow (n_rows, n_samples) array in one bulk write."""
+    header = board_header(board_id, dtype, compression)
+    if data.shape[0] != header['n_rows']:
+        raise ValueError(f"Expected {header['n_rows']} rows for board {board_id}, got {data.shape[0]}")
+
+    def iter_block(rows, block_dtype):
+        if len(rows) == data.shape[0]:
+            yield np.ascontiguousarray(data, dtype=block_dtype)  # no copy for float64 board data
+        else:
+            yield np.ascontiguousarray(data[rows], dtype=block_dtype)
+
+    _write_blocks(path, header, iter_block, data.shape[1])
+
+
+class Recording:
+    """Read access to an .eegrec file (or a spool), memory-mapped unless it is compressed."""
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self.header, data_offset = read_header(path)
+        self.board = self.header['board']
+        self.board_id = self.header['board_id']
+        self.sampling_rate = self.header['sampling_rate']
+        n_rows = self.header['n_rows']
+
+        if self.header.get('layout') == 'spool':
+            # Sample-major float64, whatever made it to disk before the writer stopped
+            n_samples = (os.path.getsize(path) - data_offset) // (8 * n_rows)
+            spool = np.memmap(path, dtype='<f8', mode=mode, offset=data_offset, shape=(n_samples, n_rows))
+            self.n_samples = n_samples
+            self._blocks = [(list(range(n_rows)), spool.T)]
+            return
+
+        self.n_samples = self.header['n_samples']
+        self._blocks = []
+        for block in self.header['blocks']:
+            shape = (len(block['rows']), self.n_samples)
+            if self.header['compression'] == 'zlib':
+                with open(path, 'rb') as file:
+                    file.seek(data_offset + block['offset'])
+                    raw = zlib.decompress(file.read(block['nbytes']))
+                array = np.frombuffer(raw, dtype=block['dtype']).reshape(shape)
+            elif self.n_samples == 0:
+                array = np.empty(shape, dtype=block['dtype'])  # np.memmap refuses empty files
+            else:
+                array = np.memmap(path, dtype=block['dtype'], mode=mode,
+                                  offset=data_offset + block['offset'], shape=shape)
+            self._blocks.append((block['rows'], array))
+
+    def rows(self, rows, start=0, stop=None):
+        """Returns the given BrainFlow rows as a (len(rows), n_samples) array.
+
+        A run of consecutive rows inside one block (e.g. the EEG channels) comes back as a
+        view on the memory map; anything else is gathered into a new array.
+        """
+        rows = list(rows)
+        for block_rows, array in self._blocks:
+            if rows and rows[0] in block_rows:
+                first = block_rows.index(rows[0])
+                if block_rows[first:first + len(rows)] == rows:
+                    return array[first:first + len(rows), start:stop]
+        return np.stack([self.row(r, start, stop) for r in rows])
+
+    def row(self, row, start=0, stop=None):
+        for block_rows, array in self._blocks:
+            if row in block_rows:
+                return array[block_rows.index(row), start:stop]
+        raise IndexError(f"Row {row} is not in {self.path}")
+
+    @property
+    def eeg(self):
+        return self.rows(self.board['eeg_channels'])
+
+    @property
+    def timestamps(self):
+        return self.row(self.board['timestamp_channel'])
+
+    @property
+    def data(self):
+        """All BrainFlow rows, shaped like board.get_board_data()."""
+        return self.rows(range(self.header['n_rows']))
+
+
+def open_recording(path, mode='r'):
+    return Recording(path, mode)
+
+
+class RecordingWriter:
+    """Appends BrainFlow chunks to a spool and writes the final .eegrec on close()."""
+
+    def __init__(self, path, board_id, dtype='float64', compression=None):
+        self.path = path
+        self.spool_path = path + SPOOL_SUFFIX
+        self.header = board_header(board_id, dtype, compression)
+        self.n_samples = 0
+        self._file = open(self.spool_path, 'wb')
+        _write_header(self._file, dict(self.header, layout='spool', n_samples=None))
+        self._file.flush()
+
+    def append(self, data):
+        """Appends a (n_rows, n_samples) chunk, flushed so it survives a crash."""
+        self._file.write(np.ascontiguousarray(data.T, dtype='<f8').tobytes())
+        self._file.flush()
+        self.n_samples += data.shape[1]
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.close()
+        recover_recording(self.spool_path, self.path)
+
+
+def recover_recording(spool_path, path=None):
+    """Turns a recording spool into an .eegrec file and removes the spool."""
+    if path is None:
+        path = spool_path[:-len(SPOOL_SUFFIX)]
+    spool = Recording(spool_path)
+    header = {k: v for k, v in spool.header.items() if k not in ('layout', 'n_samples')}
+    samples = spool.data.T  # (n_samples, n_rows), as on disk
+
+    # Reading one channel from the sample-major spool would be a strided pass over the whole
+    # file per channel. Instead the spool is read sequentially, SPOOL_CHUNK samples at a time,
+    # each run transposed into every channel at once.
+    def fill_block(rows, out):
+        for start in range(0, len(samples), SPOOL_CHUNK):
+            out[:, start:start + SPOOL_CHUNK] = samples[start:start + SPOOL_CHUNK, rows].T
+
+    def iter_block(rows, block_dtype):
+        # zlib streams go channel by channel: as many channels as fit in GATHER_BYTES per pass
+        per_pass = max(1, GATHER_BYTES // max(1, len(samples) * np.dtype(block_dtype).itemsize))
+        for first in range(0, len(rows), per_pass):
+            gathered = np.empty((len(rows[first:first + per_pass]), len(samples)), dtype=block_dtype)
+            fill_block(rows[first:first + per_pass], gathered)
+            yield from gathered
+
+    _write_blocks(path, header, iter_block, spool.n_samples, fill_block)
+    del samples, spool
+    os.remove(spool_path)
+    return path
+
+
+class CsvRecordingWriter:
+    """Appends BrainFlow chunks to a CSV file in the layout the experiment scripts always wrote."""
+
+    def __init__(self, path, board_id):
+        self.path = path
+        self.n_samples = 0
+        n_rows = BoardShim.get_num_rows(board_id)
+        self._file = open(path, mode='w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(['Timestamp'] + [f'Channel_{i}' for i in range(n_rows)])
+        self._file.flush()
+
+    def append(self, data):
+        self._writer.writerows(data.T.tolist())  # transpose to write row-wise
+        self._file.flush()
+        self.n_samples += data.shape[1]
+
+    def close(self):
+        self._file.close()
+
+
+def open_writer(path, board_id, dtype='float64', compression=None):
+    """Picks the writer from the file extension: .csv for the old text format, else .eegrec."""
+    if path.endswith('.csv'):
+        return CsvRecordingWriter(path, board_id)
+    return RecordingWriter(path, board_id, dtype, compression)
+
+
+def to_csv(path, csv_path=None, chunk_size=25000):
+    """Exports an .eegrec recording to the old CSV layout, chunk by chunk."""
+    if csv_path is None:
+        csv_path = os.path.splitext(path)[0] + '.csv'
+    recording = open_recording(path)
+    writer = CsvRecordingWriter(csv_path, recording.board_id)
+    all_rows = range(recording.header['n_rows'])
+    for start in range(0, recording.n_samples, chunk_size):
+        writer.append(recording.rows(all_rows, start, start + chunk_size))
+    writer.close()
+    return csv_path
+
+
+if __name__ == '__main__':
+    # python recording.py results/5/eeg_data.eegrec [more files...]  ->  writes the .csv next to each
+    # python recording.py results/5/eeg_data.eegrec.part             ->  recovers a crashed session
+    for file_path in sys.argv[1:]:
+        if file_path.endswith(SPOOL_SUFFIX):
+            print(f'Recovered recording saved to: {recover_recording(file_path)}')
+        else:
+            print(f'CSV export saved to: {to_csv(file_path)}')
@@ -0,0 +1,168 @@
+# Imports
+import argparse
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
+matplotlib.use('Agg')  # headless: figures go to files, never to a window
+import matplotlib.pyplot as plt
+import mne
+import numpy as np
+import seaborn as sns
+
+from bandpower import BANDS, band_power_table, epoch_means
+from batch import discover_participants
+from features import Session
+from loader import find_recording
+
+# Unattended figure report, one directory per participant:
+#   python report.py                                  # every results/<id>/, into results/<id>/report/
+#   python report.py 4 --times 0.3 2 4 --bands alpha beta --workers 4
+#
+# The expensive part (epochs, evoked responses, their difference, the Welch PSD) is computed
+# once per participant through the cached Session stages. Every figure is then a small job,
+# (renderer, data, file name), and the jobs of all participants are rendered by a process pool.
+
+REPORT_DIR = 'report'
+TIMES = [0.3, 2., 4.]  # topomap time points, seconds after word onset
+REPORT_BANDS = ['alpha', 'beta']
+CONDITION_COLORS = {'yellow': 'red', 'blue': 'blue'}  # histogram colors used by analyze.py
+# Recordings hold BrainFlow's microvolts, which MNE takes as volts: topomap values are in uV (uV^2/Hz)
+DPI = 100
+
+
+#### Renderers (run in the worker processes) ####
+
+def render_evoked(evoked, title, path):
+    fig = evoked.plot(show=False, titles={'eeg': title})
+    fig.savefig(path, dpi=DPI)
+    plt.close(fig)
+
+
+def render_topomap(values, info, title, unit, path):
+    fig, ax = plt.subplots(1, 1)
+    im, _ = mne.viz.plot_topomap(values, info, ch_type='eeg', sensors=True, names=info['ch_names'],
+                                 contours=6, outlines='head', sphere='auto', image_interp='cubic',
+                                 extrapolate='auto', border='mean', res=64, size=1, cmap='RdBu_r',
+                                 axes=ax, show=False)
+    fig.colorbar(im, ax=ax, label=unit)
+    ax.set_title(title)
+    fig.savefig(path, dpi=DPI)
+    plt.close(fig)
+
+
+def render_distribution(means, band, path):
+    """Histogram + KDE of channel-averaged band power per epoch, one color per condition."""
+    fig, ax = plt.subplots(figsize=(8, 6))
+    for condition, values in means.items():
+        sns.histplot(values, color=CONDITION_COLORS.get(condition), kde=True, label=condition.capitalize(),
+                     stat='density', linewidth=0, ax=ax)
+    ax.set_xlabel(f'{band.capitalize()} Value')
+    ax.set_ylabel('Density')
+    ax.set_title(f"Distribution of {band.capitalize()} Values for {' and '.join(c.capitalize() for c in means)}")
+    ax.legend()
+    fig.savefig(path, dpi=DPI)
+    plt.close(fig)
+
+
+def _render(job):
+    renderer, args, path = job
+    start = time.perf_counter()
+    try:
+        renderer(*args, path)
+        return {'file': path, 'ok': True, 'seconds': time.perf_counter() - start}
+    except Exception:
+        return {'file': path, 'ok': False, 'error': traceback.format_exc()}
+
+
+#### Jobs (computed once per participant, in the main process) ####
+
+def participant_jobs(folder, times=TIMES, bands=REPORT_BANDS, cache=None):
+    """Figure jobs of one participant, as (renderer, args, output path) tuples."""
+    session = Session(folder, cache)
+    epochs = session.epochs()
+    out_dir = os.path.join(folder, REPORT_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    conditions = [c for c in epochs.event_id if len(epochs[c])]
+    evoked = {c: epochs[c].average() for c in conditions}
+    jobs = [(render_evoked, (evoked[c], f'Evoked {c}'), os.path.join(out_dir, f'evoked_{c}.png'))
+            for c in conditions]
+
+    if len(conditions) == 2:
+        first, second = conditions
+        contrast = f'{first} - {second}'
+        topo_evoked = mne.combine_evoked([evoked[first], -evoked[second]], weights='equal')
+        jobs.append((render_evoked, (topo_evoked, f'Evoked {contrast}'), os.path.join(out_dir, 'evoked_diff.png')))
+    elif conditions:
+        # A single condition (e.g. the other one lost every epoch): its own topographies
+        contrast = conditions[0]
+        topo_evoked = evoked[contrast]
+    # All time points come from the one (difference) wave
+    for t in times if conditions else []:
+        idx = np.argmin(np.abs(topo_evoked.times - t))
+        jobs.append((render_topomap, (topo_evoked.data[:, idx], topo_evoked.info, f'{contrast}, {t * 1000:.0f} ms', 'µV'),
+                     os.path.join(out_dir, f'topomap_{t * 1000:.0f}ms.png')))
+
+    table = band_power_table(session.psd(), {band: BANDS[band] for band in bands})
+    for band in bands:
+        jobs.append((render_distribution, (epoch_means(table, band), band),
+                     os.path.join(out_dir, f'distribution_{band}.png')))
+        if conditions:
+            # Epoch-averaged band power per channel, first condition minus second (or the only one)
+            power = table[table['band'] == band].groupby(['condition', 'channel'], sort=False)['power'].mean()
+            topo_power = power[first] - power[second] if len(conditions) == 2 else power[contrast]
+            jobs.append((render_topomap, (topo_power.reindex(epochs.ch_names).to_numpy(), epochs.info,
+                                          f'{band} power, {contrast}', 'µV²/Hz'),
+                         os.path.join(out_dir, f'band_topomap_{band}.png')))
+    return jobs
+
+
+def run_report(root_folder='results', participants=None, times=TIMES, bands=REPORT_BANDS, max_workers=None):
+    """Builds every participant's jobs, renders them all in a process pool, writes report.json per folder."""
+    if participants is None:
+        participants = discover_participants(root_folder)
+    folders = [os.path.join(root_folder, str(p)) for p in participants]
+    folders = [folder for folder in folders if os.path.exists(find_recording(folder))]  # not baseline-only
+    manifests = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for folder in folders:
+            manifests[folder] = {'folder': folder, 'times': list(times), 'bands': list(bands), 'figures': []}
+            try:
+                jobs = participant_jobs(folder, times, bands)
+            except Exception:
+                manifests[folder]['error'] = traceback.format_exc()
+                print(f'{folder}: FAILED\n{traceback.format_exc(limit=1)}')
+                continue
+            # Rendering of this participant starts while the next one is being computed
+            for job in jobs:
+                futures[pool.submit(_render, job)] = folder
+        for future in as_completed(futures):
+            manifests[futures[future]]['figures'].append(future.result())
+
+    for folder, manifest in manifests.items():
+        if 'error' in manifest:
+            continue
+        manifest['figures'].sort(key=lambda figure: figure['file'])
+        with open(os.path.join(folder, REPORT_DIR, 'report.json'), 'w') as file:
+            json.dump(manifest, file, indent=2)
+        failed = [f for f in manifest['figures'] if not f['ok']]
+        print(f"{folder}: {len(manifest['figures']) - len(failed)} figures in {os.path.join(folder, REPORT_DIR)}"
+              + (f', {len(failed)} FAILED' if failed else ''))
+    return manifests
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Renders every figure of results/<participant_id>/ to files')
+    parser.add_argument('participants', nargs='*', help='participant ids (default: every folder in root)')
+    parser.add_argument('--root', default='results')
+    parser.add_argument('--times', nargs='+', type=float, default=TIMES, help='topomap time points (s)')
+    parser.add_argument('--bands', nargs='+', choices=list(BANDS), default=REPORT_BANDS)
+    parser.add_argument('--workers', type=int, default=None, help='rendering processes (default: CPU count)')
+    args = parser.parse_args()
+
+    mne.set_log_level('WARNING')
+    run_report(args.root, args.participants or None, args.times, args.bands, args.workers)
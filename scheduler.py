@@ -0,0 +1,53 @@
+# Imports
+import time
+
+from psychopy import core
+
+DEFAULT_FRAME_RATE = 60.  # used when PsychoPy can't measure the monitor
+
+
+class FrameScheduler:
+    """Shows stimuli for whole numbers of frames and timestamps them on the flip.
+
+    Durations are counted in frames instead of core.wait(), the onset is the time PsychoPy
+    returns for the first flip of a segment (converted to time.time() seconds, the clock
+    the stimulus log and BrainFlow use), and LSL markers are pushed from callOnFlip so they
+    leave right after the buffer swap rather than whenever the script gets to it.
+    """
+
+    def __init__(self, win, outlet=None, frame_rate=None):
+        self.win = win
+        self.outlet = outlet
+        if frame_rate is None:
+            frame_rate = win.getActualFrameRate(nIdentical=20, nMaxFrames=120) or DEFAULT_FRAME_RATE
+        self.frame_rate = frame_rate
+        self.frame_duration = 1. / frame_rate
+        win.recordFrameIntervals = True  # lets PsychoPy count dropped frames
+        win.refreshThreshold = self.frame_duration * 1.5
+        # core.getTime() and time.time() both tick in seconds, one offset converts flip times
+        self.clock_offset = time.time() - core.getTime()
+
+    def n_frames(self, seconds):
+        return max(1, int(round(seconds * self.frame_rate)))
+
+    def show(self, stims, seconds, marker=None):
+        """Draws stims every frame for `seconds`, returns onset (time.time() clock), frames and drops.
+
+        The marker, if any, is pushed on the first flip.
+        """
+        n_frames = self.n_frames(seconds)
+        dropped_before = self.win.nDroppedFrames
+        if marker is not None and self.outlet is not None:
+            self.win.callOnFlip(self.outlet.push_sample, [marker])
+        onset = None
+        for frame in range(n_frames):
+            for stim in stims:
+                stim.draw()
+            flip_time = self.win.flip()
+            if frame == 0:
+                onset = flip_time + self.clock_offset
+        return {
+            'onset': onset,
+            'frames': n_frames,
+            'dropped': self.win.nDroppedFrames - dropped_before,
+        }
@@ -0,0 +1,219 @@
+# Imports
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import sparse, stats
+from scipy.sparse.csgraph import connected_components
+
+# Two-sample permutation statistics over whole (epochs, channel, freq, time) arrays.
+#
+# Every permutation test here compares the epochs of two conditions with a pooled-variance t
+# (the statistic of scipy.stats.ttest_ind) on every feature at once. Permutations are label
+# vectors: a (batch, n_epochs) 0/1 matrix times the (n_epochs, n_features) data gives every
+# permuted group sum in one matrix product, the sums of squares in another. Batches are
+# sharded across processes; each shard seeds its own generator from (seed, shard), so the
+# result depends on the seed only, not on the number of workers.
+#
+#   t_obs, p_corrected, p_uncorrected = permutation_t_test(yellow, blue)      # max-t (FWER)
+#   t_obs, clusters, cluster_p, masses = cluster_permutation_test(yellow, blue, adjacency)
+
+N_PERMUTATIONS = 10000
+SHARD_SIZE = 500  # permutations per process task
+MAX_BATCH_BYTES = 64 * 2 ** 20  # size of the (batch, n_features) arrays one matrix product makes
+ALPHA = 0.05
+
+
+def _flatten(a, b):
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    if a.shape[1:] != b.shape[1:]:
+        raise ValueError(f'Conditions differ in shape: {a.shape[1:]} vs {b.shape[1:]}')
+    x = np.concatenate([a.reshape(len(a), -1), b.reshape(len(b), -1)])
+    return x - x.mean(axis=0), len(a), a.shape[1:]  # centred: t doesn't change, sums of squares stay exact
+
+
+def _t_from_sums(s1, q1, total, total_sq, n1, n2):
+    """Pooled-variance t from group 1 sums; group 2 is what is left of the totals."""
+    s2, q2 = total - s1, total_sq - q1
+    ss = (q1 - s1 ** 2 / n1) + (q2 - s2 ** 2 / n2)  # within-group sums of squares
+    scale = np.sqrt(np.maximum(ss, 0.) / (n1 + n2 - 2) * (1. / n1 + 1. / n2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (s1 / n1 - s2 / n2) / scale
+    return np.nan_to_num(t, nan=0., posinf=0., neginf=0.)
+
+
+def t_statistic(a, b):
+    """ttest_ind's t for every feature, shape a.shape[1:]."""
+    x, n1, shape = _flatten(a, b)
+    t = _t_from_sums(x[:n1].sum(axis=0), (x[:n1] ** 2).sum(axis=0), x.sum(axis=0), (x ** 2).sum(axis=0),
+                     n1, len(x) - n1)
+    return t.reshape(shape)
+
+
+def _tail(t, tail):
+    return np.abs(t) if tail == 0 else t * tail
+
+
+def _permuted_t(x, n1, n_permutations, seed, shard):
+    """Yields (batch, n_features) t maps for one shard's permutations."""
+    rng = np.random.default_rng([seed, shard])
+    n = len(x)
+    total, total_sq = x.sum(axis=0), (x ** 2).sum(axis=0)
+    x_sq = x ** 2
+    batch_size = max(1, min(n_permutations, MAX_BATCH_BYTES // (8 * x.shape[1] * 4)))
+    for start in range(0, n_permutations, batch_size):
+        size = min(batch_size, n_permutations - start)
+        # A random permutation per row; its first n1 positions go to group 1
+        labels = (rng.random((size, n)).argsort(axis=1) < n1).astype(float)
+        yield _t_from_sums(labels @ x, labels @ x_sq, total, total_sq, n1, n - n1)
+
+
+#### Worker side: the data is sent once per process, not once per shard ####
+
+_shared = {}
+
+
+def _init_worker(shared):
+    _shared.update(shared)
+
+
+def _max_t_shard(n_permutations, seed, shard, tail):
+    """Max statistic of every permutation, and per feature how often the observed one was reached."""
+    x, n1, observed = _shared['x'], _shared['n1'], _tail(_shared['t_obs'], tail)
+    max_t, exceed = [], np.zeros(len(observed), dtype=np.int64)
+    for t in _permuted_t(x, n1, n_permutations, seed, shard):
+        t = _tail(t, tail)
+        max_t.append(t.max(axis=1))
+        exceed += (t >= observed).sum(axis=0)
+    return np.concatenate(max_t), exceed
+
+
+def _cluster_masses(t, threshold, adjacency, tail):
+    """Summed t of every supra-threshold cluster of one t map: (labels, masses).
+
+    labels is -1 outside clusters. Positive and negative clusters are found separately.
+    """
+    labels = np.full(len(t), -1)
+    masses = []
+    for sign in ((1, -1) if tail == 0 else (tail,)):
+        mask = np.flatnonzero(sign * t > threshold)
+        if not len(mask):
+            continue
+        n_clusters, component = connected_components(adjacency[mask][:, mask], directed=False)
+        labels[mask] = component + len(masses)
+        masses.extend(np.bincount(component, weights=t[mask], minlength=n_clusters))
+    return labels, np.asarray(masses)
+
+
+def _max_cluster_shard(n_permutations, seed, shard, tail):
+    """Largest cluster mass of every permutation (0 when nothing crosses the threshold)."""
+    x, n1 = _shared['x'], _shared['n1']
+    threshold, adjacency = _shared['threshold'], _shared['adjacency']
+    null = []
+    for t_batch in _permuted_t(x, n1, n_permutations, seed, shard):
+        for t in t_batch:
+            _, masses = _cluster_masses(t, threshold, adjacency, tail)
+            null.append(_tail(masses, tail).max() if len(masses) else 0.)
+    return np.asarray(null)
+
+
+def _run_shards(task, n_permutations, seed, tail, n_jobs, shared):
+    """Runs task over n_permutations in SHARD_SIZE shards, in worker processes unless n_jobs == 1."""
+    shards = [(min(SHARD_SIZE, n_permutations - start), seed, i, tail)
+              for i, start in enumerate(range(0, n_permutations, SHARD_SIZE))]
+    if n_jobs == 1 or len(shards) == 1:
+        _init_worker(shared)
+        try:
+            return [task(*shard) for shard in shards]
+        finally:
+            _shared.clear()
+    n_jobs = min(n_jobs or os.cpu_count(), len(shards))
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(shared,)) as pool:
+        return list(pool.map(task, *zip(*shards)))
+
+
+#### Tests ####
+
+def _n_reached(null, observed):
+    """For every observed value, how many null values are >= it (sorted, not a comparison matrix)."""
+    return len(null) - np.searchsorted(np.sort(null), observed, side='left')
+
+
+def permutation_t_test(a, b, n_permutations=N_PERMUTATIONS, tail=0, seed=0, n_jobs=None):
+    """Permutation t-test of every feature of a vs b (epochs first, any feature shape).
+
+    Returns (t_obs, p_corrected, p_uncorrected), all shaped like a.shape[1:]. p_corrected
+    controls the family-wise error over all features with the max-t distribution; tail is
+    0 (two-sided), 1 (a > b) or -1 (a < b).
+    """
+    x, n1, shape = _flatten(a, b)
+    t_obs = t_statistic(a, b).ravel()
+    shards = _run_shards(_max_t_shard, n_permutations, seed, tail, n_jobs, {'x': x, 'n1': n1, 't_obs': t_obs})
+    max_t = np.concatenate([max_t for max_t, _ in shards])
+    exceed = sum(exceed for _, exceed in shards)
+    observed = _tail(t_obs, tail)
+    # The observed labelling counts as one of the permutations, so p is never 0
+    p_corrected = (1 + _n_reached(max_t, observed)) / (1 + n_permutations)
+    p_uncorrected = (1 + exceed) / (1 + n_permutations)
+    return t_obs.reshape(shape), p_corrected.reshape(shape), p_uncorrected.reshape(shape)
+
+
+def lattice_adjacency(n):
+    """Neighbours along one sampled axis (frequency or time): i ~ i + 1."""
+    return sparse.diags([np.ones(n - 1), np.ones(n - 1)], [-1, 1], shape=(n, n), format='csr')
+
+
+def feature_adjacency(shape, ch_adjacency=None):
+    """Sparse adjacency of the flattened features of a (channel, freq, time)-like shape.
+
+    The first axis uses ch_adjacency (e.g. from channel_adjacency(info); None means channels are
+    never neighbours), the other axes are lattices. Features are adjacent when they differ along
+    one axis only, by one neighbour step.
+    """
+    axes = [sparse.csr_matrix(ch_adjacency) if ch_adjacency is not None else sparse.csr_matrix((shape[0], shape[0]))]
+    axes += [lattice_adjacency(n) for n in shape[1:]]
+    adjacency = sparse.csr_matrix((int(np.prod(shape)), int(np.prod(shape))))
+    for i, axis in enumerate(axes):
+        term = sparse.identity(1, format='csr')
+        for j, n in enumerate(shape):
+            term = sparse.kron(term, axis if i == j else sparse.identity(n, format='csr'), format='csr')
+        adjacency = adjacency + term
+    adjacency.setdiag(0)
+    adjacency.eliminate_zeros()
+    return (adjacency != 0).tocsr()
+
+
+def channel_adjacency(info):
+    """Channel neighbours from the montage (Delaunay triangulation of the sensor positions)."""
+    import mne
+    adjacency, _ = mne.channels.find_ch_adjacency(info, ch_type='eeg')
+    return adjacency
+
+
+def cluster_permutation_test(a, b, adjacency=None, threshold=None, n_permutations=N_PERMUTATIONS, tail=0,
+                             seed=0, n_jobs=None):
+    """Cluster-based permutation test of a vs b over all features (epochs first).
+
+    Features whose t crosses threshold (default: the two-sided p < ALPHA t quantile) form
+    clusters with their supra-threshold neighbours (adjacency over flattened features, see
+    feature_adjacency; default: lattice on every axis). Each cluster's summed t is compared
+    with the largest cluster of every permutation.
+
+    Returns (t_obs, clusters, cluster_p, masses): clusters is a list of boolean masks shaped
+    like a.shape[1:], cluster_p and masses one value per cluster.
+    """
+    x, n1, shape = _flatten(a, b)
+    if adjacency is None:
+        adjacency = feature_adjacency(shape, lattice_adjacency(shape[0]))
+    adjacency = sparse.csr_matrix(adjacency)
+    if threshold is None:
+        df = len(x) - 2
+        threshold = stats.t.ppf(1 - ALPHA / (2 if tail == 0 else 1), df)
+
+    t_obs = t_statistic(a, b).ravel()
+    labels, masses = _cluster_masses(t_obs, threshold, adjacency, tail)
+    shared = {'x': x, 'n1': n1, 'threshold': threshold, 'adjacency': adjacency}
+    null = np.concatenate(_run_shards(_max_cluster_shard, n_permutations, seed, tail, n_jobs, shared))
+    cluster_p = (1 + _n_reached(null, _tail(masses, tail))) / (1 + n_permutations)
+    clusters = [(labels == i).reshape(shape) for i in range(len(masses))]
+    return t_obs.reshape(shape), clusters, cluster_p, masses
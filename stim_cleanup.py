@@ -2,37 +2,57 @@
 import os
 import pandas as pd
 
+from events import session_config
+
 # Define the parent "results" folder
 root_folder = 'results'
 
-# Subfolders to process
-subfolders = [1, 2, 3, 4]
-
 # Files to process in each subfolder
 filename = 'stimulus_log.csv'
 
-for subfolder in subfolders:
-    # Build the full path to the CSV
-        file_path = os.path.join(root_folder, str(subfolder), filename)
-        
-        # Read the CSV
-        stim_log = pd.read_csv(file_path)
-
-        # --- Begin cleaning steps ---
-
-        # Define hex-->color
-        color_map = {
-            '#F1E05C': 'yellow',
-            '#A6D5FF': 'blue'
-        }
-        # Replace
-        stim_log['Color'] = stim_log['Color'].map(color_map)
-
-        # --- End cleaning steps ---
-
-        # Save the cleaned DataFrame to a new file
-        cleaned_filename = os.path.splitext(filename)[0] + '_cleaned.csv'
-        cleaned_file_path = os.path.join(root_folder, str(subfolder), cleaned_filename)
-        stim_log.to_csv(cleaned_file_path, index=False)
-        
-        print(f'Cleaned file saved to: {cleaned_file_path}')
\ No newline at end of file
+# Define hex-->color, for sessions recorded before the config files
+color_map = {
+    '#F1E05C': 'yellow',
+    '#A6D5FF': 'blue'
+}
+
+
+def session_color_map(folder):
+    """#HEX (upper case) --> condition name of the session's config, color_map without one."""
+    config = session_config(folder)
+    colors = color_map if config is None else {color: name for name, color in config['conditions'].items()}
+    return {color.upper(): name for color, name in colors.items()}
+
+
+def clean_stim_log(file_path, cleaned_file_path=None):
+    """Maps the #HEX colors of a stimulus log to condition names and saves it as *_cleaned.csv."""
+    if cleaned_file_path is None:
+        cleaned_file_path = os.path.splitext(file_path)[0] + '_cleaned.csv'
+
+    # Read the CSV
+    stim_log = pd.read_csv(file_path)
+
+    # --- Begin cleaning steps ---
+
+    # Replace: logs written by experiment.py name the condition, older ones only have the #HEX
+    if 'Condition' in stim_log:
+        stim_log['Color'] = stim_log['Condition']
+    else:
+        stim_log['Color'] = stim_log['Color'].str.upper().map(session_color_map(os.path.dirname(file_path)))
+
+    # --- End cleaning steps ---
+
+    # Save the cleaned DataFrame to a new file
+    stim_log.to_csv(cleaned_file_path, index=False)
+    return cleaned_file_path
+
+
+if __name__ == '__main__':
+    for subfolder in sorted(os.listdir(root_folder)):
+        # Build the full path to the CSV
+        file_path = os.path.join(root_folder, subfolder, filename)
+        if not os.path.exists(file_path):
+            continue
+
+        cleaned_file_path = clean_stim_log(file_path)
+        print(f'Cleaned file saved to: {cleaned_file_path}')
@@ -0,0 +1,99 @@
+# Imports
+import numpy as np
+import pandas as pd
+
+from events import nearest_samples
+
+# Stimulus/EEG clock synchronisation.
+#
+# BrainFlow stamps samples with the host clock (the same time.time() the experiment logs
+# stimuli with) when it reads them from the dongle, so the timestamp column is bursty and
+# the board's crystal drifts against the nominal 250 Hz. Instead of onset = (t - t0) * 250,
+# fit the host time of every sample as offset + period * n, where n counts samples including
+# those lost in transmission (from the Cyton package counter), and snap events on that line.
+
+PACKAGE_MODULO = 256  # Cyton package counter wraps at 255
+OUTLIER_FACTOR = 5.  # residuals above this many MADs are left out of the refit
+
+
+def sample_index(package_num, step=1, modulo=PACKAGE_MODULO):
+    """Sample number of every recorded sample, counting dropped samples from counter gaps.
+
+    Returns (index, gaps) with gaps a (n_gaps, 2) array of (recorded sample, samples missing).
+    """
+    package_num = np.asarray(package_num, dtype=np.int64)
+    steps = np.diff(package_num) % modulo
+    steps[steps == 0] = modulo  # a full wrap, the counter can't stand still
+    index = np.zeros(len(package_num), dtype=np.int64)
+    np.cumsum(steps // step, out=index[1:])
+    missing = steps // step - 1
+    gap_at = np.flatnonzero(missing) + 1
+    return index, np.column_stack([gap_at, missing[gap_at - 1]])
+
+
+def _fit_line(x, y):
+    x_mean, y_mean = x.mean(), y.mean()
+    dx = x - x_mean
+    slope = np.dot(dx, y - y_mean) / np.dot(dx, dx)
+    return y_mean - slope * x_mean, slope
+
+
+class ClockSync:
+    """Linear fit of host time against sample number for one recording."""
+
+    def __init__(self, timestamps, package_num=None, step=1):
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        if package_num is None:
+            self.index = np.arange(len(self.timestamps), dtype=np.int64)
+            self.gaps = np.empty((0, 2), dtype=np.int64)
+        else:
+            self.index, self.gaps = sample_index(package_num, step)
+
+        # Fit relative to the first sample so float64 keeps sub-microsecond resolution
+        t0 = self.timestamps[0]
+        x = self.index.astype(np.float64)
+        y = self.timestamps - t0
+        offset, period = _fit_line(x, y)
+        residuals = y - (offset + period * x)
+        mad = np.median(np.abs(residuals - np.median(residuals)))
+        keep = np.abs(residuals) <= OUTLIER_FACTOR * mad + 1e-9
+        if not keep.all():
+            offset, period = _fit_line(x[keep], y[keep])
+
+        self.offset = t0 + offset
+        self.period = period
+        self.corrected = t0 + offset + period * x  # drift-corrected host time of each sample
+        self.jitter = self.timestamps - self.corrected
+
+    @property
+    def sfreq(self):
+        """Effective sampling rate of the board against the host clock."""
+        return 1. / self.period
+
+    @property
+    def n_dropped(self):
+        return int(self.gaps[:, 1].sum())
+
+    def samples(self, times):
+        """Recorded sample closest to each host time, on the corrected clock."""
+        return nearest_samples(self.corrected, np.asarray(times, dtype=np.float64))
+
+    def alignment(self, times):
+        """Per-event table: snapped sample, its corrected time and the alignment error in ms.
+
+        error_ms is what snapping to a whole sample costs (at most half a sample period,
+        more next to a gap); raw_offset_ms is how far the raw BrainFlow timestamp of that
+        sample was from the fitted clock, i.e. what naive timestamp matching would be off by.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        samples = self.samples(times)
+        return pd.DataFrame({
+            'sample': samples,
+            'sample_time': self.corrected[samples],
+            'error_ms': (self.corrected[samples] - times) * 1e3,
+            'raw_offset_ms': self.jitter[samples] * 1e3,
+        })
+
+    def summary(self):
+        return (f"Clock fit: {self.sfreq:.3f} Hz effective, timestamp jitter "
+                f"{self.jitter.std() * 1e3:.1f} ms (sd), {len(self.gaps)} gaps / {self.n_dropped} samples dropped")
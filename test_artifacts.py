@@ -0,0 +1,49 @@
+# Imports
+import mne
+import numpy as np
+
+from artifacts import apply_artifacts, detect_artifacts
+from bandpower import band_power, band_power_table
+from baseline import normalize, pick_channels
+from loader import CH_NAMES
+
+# python -m pytest test_artifacts.py
+
+SFREQ = 250.
+
+
+def make_epochs(n_bad, n_epochs=20, seed=0):
+    """Noise epochs, yellow and blue, whose last n_bad channels hold a 500 uV step in every epoch."""
+    rng = np.random.default_rng(seed)
+    data = 10 * rng.standard_normal((n_epochs, len(CH_NAMES), int(2 * SFREQ)))
+    data[:, len(CH_NAMES) - n_bad:, int(SFREQ):] += 500.  # not Fp1/Fp2, those would be blinks
+    info = mne.create_info(CH_NAMES, SFREQ, 'eeg')
+    events = np.column_stack([np.arange(n_epochs) * 1000, np.zeros(n_epochs, int), 1 + np.arange(n_epochs) % 2])
+    epochs = mne.EpochsArray(data, info, events, event_id={'yellow': 1, 'blue': 2}, verbose='ERROR')
+    return epochs.set_montage(mne.channels.make_standard_montage('standard_1020'))
+
+
+def test_few_bad_channels_are_interpolated():
+    epochs = make_epochs(n_bad=2)
+    artifacts = detect_artifacts(epochs)
+    assert artifacts['bad_channels'] == CH_NAMES[-2:]
+    clean = apply_artifacts(epochs, artifacts)
+    assert clean.ch_names == CH_NAMES and clean.info['bads'] == []
+
+
+def test_half_bad_channels_are_dropped():
+    epochs = make_epochs(n_bad=4)
+    artifacts = detect_artifacts(epochs)
+    assert artifacts['bad_channels'] == CH_NAMES[-4:]
+    assert artifacts['ch_names'] == CH_NAMES
+    clean = apply_artifacts(epochs, artifacts)
+    assert clean.ch_names == CH_NAMES[:4] and len(clean) == len(epochs)
+
+    # Every later stage sees the same 4 channels: the PSD, the band power table and the baseline
+    spectrum = clean.compute_psd(method='welch', fmin=1., fmax=45., n_fft=int(SFREQ), verbose='ERROR')
+    assert spectrum.get_data().shape[1] == 4
+    table = band_power_table(spectrum)
+    assert sorted(table['channel'].unique()) == sorted(CH_NAMES[:4])
+    resting = {'ch_names': CH_NAMES, 'psd': np.ones((8, 1)), 'mean': np.ones((8, 5)), 'std': np.ones((8, 5))}
+    power = band_power(spectrum.get_data(), spectrum.freqs)
+    assert normalize(power, pick_channels(resting, clean.ch_names)).shape == power.shape
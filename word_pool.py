@@ -0,0 +1,78 @@
+# Imports
+import hashlib
+import json
+import os
+
+# Word stimuli pool, built once offline from the NLTK corpora:
+#   python word_pool.py        # needs network the first time (nltk.download)
+# and loaded by the experiment at startup without NLTK, network or corpus parsing.
+#
+# The pool keeps the exact order (and duplicates) of the list the experiment used to build
+# at launch, so random.seed(42) followed by random.sample(pool, n) picks the same words.
+
+POOL_VERSION = 1
+POOL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stimuli', f'word_pool_v{POOL_VERSION}.json')
+
+# Selection rules, part of the pool version: bump POOL_VERSION when changing them
+MIN_LENGTH = 3  # words must be longer than this
+MIN_FREQ, MAX_FREQ = 50, 200  # exclusive bounds on the Gutenberg count
+
+
+def _checksum(words):
+    return hashlib.sha256('\n'.join(words).encode('utf-8')).hexdigest()
+
+
+def build_pool(path=POOL_FILE):
+    """Filters the NLTK 'words' list to medium-frequency Gutenberg words and saves the pool."""
+    import nltk
+    from nltk import FreqDist
+    from nltk.corpus import gutenberg, stopwords, words
+
+    for corpus in ('words', 'stopwords', 'gutenberg'):
+        if not nltk.download(corpus):  # already present, or downloaded
+            raise RuntimeError(f'Could not download the NLTK {corpus!r} corpus, build the pool on a machine with '
+                               f'network (python word_pool.py) and commit {os.path.relpath(path)}')
+
+    word_list = words.words()
+    gutenberg_words = gutenberg.words()
+
+    # Create a frequency distribution of words in the Gutenberg corpus
+    freq_dist = FreqDist(gutenberg_words)
+    stop_words = set(stopwords.words('english'))
+    filtered_words = [
+        word.lower() for word in word_list
+        if word.isalpha() and len(word) > MIN_LENGTH and word not in stop_words
+    ]
+    medium_frequency_words = [
+        word for word in filtered_words if MIN_FREQ < freq_dist[word] < MAX_FREQ
+    ]
+
+    pool = {
+        'version': POOL_VERSION,
+        'rules': {'min_length': MIN_LENGTH, 'min_freq': MIN_FREQ, 'max_freq': MAX_FREQ,
+                  'corpora': ['words', 'stopwords', 'gutenberg']},
+        'words': medium_frequency_words,
+        'freqs': [freq_dist[word] for word in medium_frequency_words],
+        'sha256': _checksum(medium_frequency_words),
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(pool, file, separators=(',', ':'))
+    return path
+
+
+def load_pool(path=POOL_FILE):
+    """Returns the pool's word list, building the pool first if it doesn't exist yet."""
+    if not os.path.exists(path):
+        print(f'Word pool {path} not found, building it from the NLTK corpora (one-off)...')
+        build_pool(path)
+    with open(path) as file:
+        pool = json.load(file)
+    if pool['version'] != POOL_VERSION or pool['sha256'] != _checksum(pool['words']):
+        raise ValueError(f'{path} is not a valid version {POOL_VERSION} word pool, rebuild it with python word_pool.py')
+    return pool['words']
+
+
+if __name__ == '__main__':
+    pool_file = build_pool()
+    print(f'{len(load_pool(pool_file))} words saved to: {pool_file}')